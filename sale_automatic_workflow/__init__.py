@@ -23,7 +23,9 @@
 
 from . import sale
 from . import sale_workflow_process
+from . import automatic_workflow_queue
 from . import automatic_workflow_job
+from . import automatic_workflow_job_run
 from . import invoice
 from . import stock_picking
 from . import stock_move
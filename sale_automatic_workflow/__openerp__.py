@@ -32,6 +32,7 @@
     'data': ['sale_view.xml',
              'sale_workflow.xml',
              'sale_workflow_process_view.xml',
+             'automatic_workflow_job_run_view.xml',
              'automatic_workflow_data.xml',
              'security/ir.model.access.csv',
              ],
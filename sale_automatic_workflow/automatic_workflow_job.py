@@ -45,12 +45,42 @@ it: sebastien.beau@akretion.com
 """
 
 import logging
+import threading
+import time
+import traceback
 from contextlib import contextmanager
-from openerp import models, api
+from Queue import Queue, Empty
+from datetime import datetime
+from openerp import models, fields, api
 
 _logger = logging.getLogger(__name__)
 
 
+class StepStats(object):
+    """ Metrics of a step of the automatic workflow job
+
+    The workers processing the records of a step in parallel share the
+    same instance, so the counters are protected by a lock.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.errors = []  # list of (res_model, res_id, message)
+        self.elapsed = 0.
+
+    def add_processed(self, records):
+        with self.lock:
+            self.processed += len(records)
+
+    def add_error(self, records, message):
+        """ Keep the error raised on ``records``, one error per record """
+        with self.lock:
+            for record in records:
+                self.errors.append((record._name, record.id, message))
+
+
 @contextmanager
 def commit(cr):
     """
@@ -76,47 +106,338 @@ class AutomaticWorkflowJob(models.Model):
 
     @api.model
     def _get_domain_for_sale_validation(self):
-        return [('state', '=', 'draft'),
-                ('workflow_process_id.validate_order', '=', True)]
+        queue_obj = self.env['automatic.workflow.queue']
+        return queue_obj._get_pending_domain('sale.order')
 
     @api.model
-    def _validate_sale_orders(self):
-        sale_obj = self.env['sale.order']
-        sales = sale_obj.search(self._get_domain_for_sale_validation())
+    def _get_domain_for_invoice_validation(self):
+        queue_obj = self.env['automatic.workflow.queue']
+        return queue_obj._get_pending_domain('account.invoice')
+
+    @api.model
+    def _get_domain_for_picking_validation(self):
+        queue_obj = self.env['automatic.workflow.queue']
+        domain = queue_obj._get_pending_domain('stock.picking')
+        # skip the pickings postponed or quarantined after failures
+        max_retries = self._get_picking_max_retries()
+        domain += ['|',
+                   ('workflow_next_retry', '=', False),
+                   ('workflow_next_retry', '<=', fields.Datetime.now()),
+                   ]
+        if max_retries:
+            domain.append(('workflow_retry_count', '<', max_retries))
+        return domain
+
+    @api.model
+    def _search_queued(self, model_name, domain):
+        """ Return the queued records of a model matching the domain,
+        and all the queued records of the model """
+        queue_obj = self.env['automatic.workflow.queue']
+        queued = queue_obj._get_queued(model_name)
+        if not queued:
+            return queued, queued
+        records = queued.search(domain + [('id', 'in', queued.ids)])
+        return records, queued
+
+    @api.model
+    def _get_batch_size(self):
+        """ Number of records processed in a transaction, configured with
+        the system parameter ``sale_automatic_workflow.batch_size`` """
+        param_obj = self.env['ir.config_parameter']
+        batch_size = param_obj.get_param('sale_automatic_workflow.batch_size')
+        try:
+            return max(int(batch_size or 1), 1)
+        except ValueError:
+            return 1
+
+    @api.model
+    def _get_picking_max_retries(self):
+        """ Number of failed automatic validations after which a picking is
+        no longer validated automatically, configured with the system
+        parameter ``sale_automatic_workflow.picking_max_retries``
+        (0 means no limit) """
+        param_obj = self.env['ir.config_parameter']
+        max_retries = param_obj.get_param(
+            'sale_automatic_workflow.picking_max_retries')
+        try:
+            return max(int(max_retries or 5), 0)
+        except ValueError:
+            return 5
+
+    @api.model
+    def _get_workers(self):
+        """ Number of workers processing the records in parallel, configured
+        with the system parameter ``sale_automatic_workflow.workers`` """
+        param_obj = self.env['ir.config_parameter']
+        workers = param_obj.get_param('sale_automatic_workflow.workers')
+        try:
+            return max(int(workers or 1), 1)
+        except ValueError:
+            return 1
+
+    @api.model
+    def _process_records(self, records, action, stats=None, prefetch=None,
+                         bulk=False, on_failure=None, groups=None):
+        """ Apply ``action`` on each record, committing by batches
+
+        A failing batch is rolled back and split in two halves which are
+        processed again, until the failing records are isolated. So only
+        the failing records are skipped, like when the records are
+        committed one by one.
+
+        With several workers, the records are sharded by id between
+        workers, each one running in its own thread with its own cursor.
+
+        :param action: callable receiving a record
+        :param stats: optional ``StepStats`` counting the processed records
+                      and the errors
+        :param prefetch: optional callable receiving the records of a batch
+                         before they are processed, used to load their
+                         related records at once
+        :param bulk: when True, ``action`` receives the records of a batch
+                     at once instead of each record
+        :param on_failure: optional callable receiving a record which
+                           failed, called in a new transaction
+        :param groups: optional list of lists of recordsets splitting
+                       ``records``; each item of the list is processed by a
+                       single worker, its recordsets in order and each one
+                       in its own batches, instead of sharding the records
+                       by id
+        """
+        options = dict(stats=stats, prefetch=prefetch, bulk=bulk,
+                       on_failure=on_failure)
+        workers = self._get_workers()
+        parallel = workers > 1 and len(records) > 1
+        if groups is None:
+            if parallel:
+                groups = self._shard_records(records, workers)
+            else:
+                groups = [[records]]
+        if parallel and len(groups) > 1:
+            self._process_records_parallel(records._name, groups, action,
+                                           workers, **options)
+        else:
+            for group in groups:
+                for group_records in group:
+                    self._process_in_batches(group_records, action,
+                                             **options)
+
+    @api.model
+    def _shard_records(self, records, workers):
+        """ Split the records by id between the workers """
+        shards = [[] for __ in range(workers)]
+        for record_id in records.ids:
+            shards[record_id % workers].append(record_id)
+        return [[records.browse(shard)] for shard in shards if shard]
+
+    @api.model
+    def _process_records_parallel(self, model_name, groups, action, workers,
+                                  **options):
+        queue = Queue()
+        for group in groups:
+            queue.put([group_records.ids for group_records in group])
+        threads = []
+        for index in range(min(workers, len(groups))):
+            thread = threading.Thread(
+                target=self._process_groups_worker,
+                args=(model_name, queue, action),
+                kwargs=options,
+                name='automatic.workflow.job.%d' % index)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        # start a new transaction to see the changes of the workers
+        self.env.cr.commit()
+        self.env.invalidate_all()
+
+    @api.model
+    def _process_groups_worker(self, model_name, queue, action, **options):
+        """ Process the groups of records of the queue until it is empty,
+        with a new cursor """
+        with api.Environment.manage():
+            with self.pool.cursor() as cr:
+                env = api.Environment(cr, self.env.uid, self.env.context)
+                job = env['automatic.workflow.job']
+                while True:
+                    try:
+                        group = queue.get_nowait()
+                    except Empty:
+                        return
+                    for record_ids in group:
+                        records = env[model_name].browse(record_ids)
+                        job._process_in_batches(records, action, lock=True,
+                                                **options)
+
+    @api.model
+    def _lock_records(self, records):
+        """ Lock the records for the current transaction, skipping the
+        ones already locked by another transaction (another worker, or a
+        user editing them)
+
+        :returns: the locked records
+        """
+        if not records:
+            return records
+        self.env.cr.execute(
+            'SELECT id FROM "%s" WHERE id IN %%s '
+            'FOR UPDATE SKIP LOCKED' % records._table,
+            (tuple(records.ids),))
+        locked_ids = set(row[0] for row in self.env.cr.fetchall())
+        return records.filtered(lambda record: record.id in locked_ids)
+
+    @api.model
+    def _process_in_batches(self, records, action, lock=False, **options):
+        batch_size = self._get_batch_size()
+        for index in range(0, len(records), batch_size):
+            self._process_batch(records[index:index + batch_size], action,
+                                lock=lock, **options)
+
+    @api.model
+    def _process_batch(self, records, action, lock=False, stats=None,
+                       prefetch=None, bulk=False, on_failure=None):
+        cr = self.env.cr
+        try:
+            if lock:
+                records = self._lock_records(records)
+            if prefetch is not None:
+                prefetch(records)
+            if bulk:
+                if records:
+                    action(records)
+            else:
+                for record in records:
+                    action(record)
+        except Exception:
+            cr.rollback()
+            self.env.invalidate_all()
+            if len(records) == 1:
+                _logger.exception('Error during an automatic workflow '
+                                  'action on %s.', records)
+                if stats is not None:
+                    stats.add_error(records, traceback.format_exc())
+                if on_failure is not None:
+                    with commit(cr):
+                        on_failure(records)
+                return
+            half = len(records) // 2
+            options = dict(lock=lock, stats=stats, prefetch=prefetch,
+                           bulk=bulk, on_failure=on_failure)
+            self._process_batch(records[:half], action, **options)
+            self._process_batch(records[half:], action, **options)
+        else:
+            cr.commit()
+            if stats is not None:
+                stats.add_processed(records)
+
+    @api.model
+    def _dequeue_processed(self, records):
+        with commit(self.env.cr):
+            self.env['automatic.workflow.queue']._dequeue_processed(records)
+
+    @api.model
+    def _validate_sale_orders(self, stats=None):
+        sales, queued = self._search_queued(
+            'sale.order', self._get_domain_for_sale_validation())
         _logger.debug('Sale Orders to validate: %s', sales)
-        for sale in sales:
-            with commit(self.env.cr):
-                sale.action_button_confirm()
+        self._process_records(sales, lambda sale: sale.action_button_confirm(),
+                              stats=stats)
+        self._dequeue_processed(queued)
 
     @api.model
-    def _validate_invoices(self):
-        invoice_obj = self.env['account.invoice']
-        invoices = invoice_obj.search(
-            [('state', 'in', ['draft']),
-             ('workflow_process_id.validate_invoice', '=', True)],
-        )
+    def _validate_invoices(self, stats=None):
+        invoices, queued = self._search_queued(
+            'account.invoice', self._get_domain_for_invoice_validation())
         _logger.debug('Invoices to validate: %s', invoices)
-        for invoice in invoices:
-            with commit(self.env.cr):
-                invoice.signal_workflow('invoice_open')
+        self._process_records(
+            invoices,
+            lambda invoice: invoice.signal_workflow('invoice_open'),
+            stats=stats,
+            prefetch=self._prefetch_invoices,
+            groups=self._group_invoices_for_validation(invoices))
+        self._dequeue_processed(queued)
+
+    @api.model
+    def _group_invoices_for_validation(self, invoices):
+        """ Group the invoices by journal, then by period
+
+        The invoices of a batch then use the same journal sequence and the
+        same period, so a transaction only locks one sequence (when it has
+        no gap). All the invoices of a journal are validated by the same
+        worker, so the workers do not wait for each other on the sequences.
+        Within a period, the invoices are kept sorted by id so they are
+        numbered in their order of creation.
+
+        :returns: list with, for each journal, the list of the recordsets
+                  of its periods
+        """
+        groups = {}
+        today = fields.Date.context_today(self)
+        for invoice in sorted(invoices, key=lambda invoice: invoice.id):
+            if invoice.period_id:
+                period_key = invoice.period_id.id
+            else:
+                # the period will be computed from the invoice date
+                period_key = (invoice.date_invoice or today)[:7]
+            journal_groups = groups.setdefault(invoice.journal_id.id, {})
+            journal_groups.setdefault(period_key, []).append(invoice.id)
+        return [[invoices.browse(invoice_ids)
+                 for __, invoice_ids in sorted(periods.iteritems())]
+                for __, periods in sorted(groups.iteritems())]
+
+    @api.model
+    def _prefetch_invoices(self, invoices):
+        """ Load at once the records used by the validation of a batch of
+        invoices, instead of reading them invoice by invoice """
+        invoices.mapped('partner_id.commercial_partner_id')
+        invoices.mapped('account_id')
+        invoices.mapped('currency_id')
+        lines = invoices.mapped('invoice_line')
+        lines.mapped('account_id')
+        lines.mapped('product_id')
+        lines.mapped('invoice_line_tax_id')
+        invoices.mapped('tax_line.account_id')
 
     @api.model
-    def _validate_pickings(self):
-        picking_obj = self.env['stock.picking']
-        pickings = picking_obj.search(
-            [('state', 'in', ['draft', 'confirmed', 'assigned']),
-             ('workflow_process_id.validate_picking', '=', True)],
-        )
+    def _validate_pickings(self, stats=None):
+        pickings, queued = self._search_queued(
+            'stock.picking', self._get_domain_for_picking_validation())
         _logger.debug('Pickings to validate: %s', pickings)
-        if pickings:
-            with commit(self.env.cr):
-                pickings.validate_picking()
+        self._process_records(
+            pickings,
+            lambda pickings: pickings.validate_picking(),
+            stats=stats,
+            bulk=True,
+            on_failure=lambda picking: picking.postpone_workflow_validation())
+        self._dequeue_processed(queued)
+
+    @api.model
+    def _get_steps(self):
+        """ Steps of the job, in order of execution
+
+        Each step is a tuple (name, method name), the method receives a
+        ``StepStats`` collecting the metrics of the step. Extend this
+        method to add steps.
+        """
+        return [('sale_order', '_validate_sale_orders'),
+                ('invoice', '_validate_invoices'),
+                ('picking', '_validate_pickings'),
+                ]
 
     @api.model
     def run(self):
         """ Must be called from ir.cron """
-
-        self._validate_sale_orders()
-        self._validate_invoices()
-        self._validate_pickings()
+        date_start = datetime.utcnow()
+        steps = []
+        for name, method in self._get_steps():
+            stats = StepStats(name)
+            start = time.time()
+            getattr(self, method)(stats=stats)
+            stats.elapsed = time.time() - start
+            steps.append(stats)
+        # the idle runs are not logged, the job is run every minute
+        if any(stats.processed or stats.errors for stats in steps):
+            with commit(self.env.cr):
+                self.env['automatic.workflow.job.run'].log_run(date_start,
+                                                               steps)
         return True
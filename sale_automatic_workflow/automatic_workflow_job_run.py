@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+#    sale_automatic_workflow for OpenERP
+#    Copyright (C) 2011 Akretion Sébastien BEAU <sebastien.beau@akretion.com>
+#    Copyright 2013 Camptocamp SA (Guewen Baconnier)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+
+from datetime import datetime, timedelta
+
+from openerp import models, fields, api
+
+
+class AutomaticWorkflowJobRun(models.Model):
+    """ Log of a run of the automatic workflow job """
+
+    _name = 'automatic.workflow.job.run'
+    _description = 'Automatic Workflow Job Run'
+    _order = 'date_start desc, id desc'
+    _rec_name = 'date_start'
+
+    date_start = fields.Datetime(string='Start', readonly=True, index=True)
+    elapsed_time = fields.Float(string='Elapsed Time (s)', readonly=True)
+    processed_count = fields.Integer(string='Processed', readonly=True)
+    failure_count = fields.Integer(string='Failures', readonly=True)
+    step_ids = fields.One2many(
+        comodel_name='automatic.workflow.job.run.step',
+        inverse_name='run_id',
+        string='Steps',
+        readonly=True)
+    error_ids = fields.One2many(
+        comodel_name='automatic.workflow.job.run.error',
+        inverse_name='run_id',
+        string='Errors',
+        readonly=True)
+
+    @api.model
+    def _get_retention_days(self):
+        """ Number of days the runs are kept, configured with the system
+        parameter ``sale_automatic_workflow.run_retention_days`` """
+        param_obj = self.env['ir.config_parameter']
+        days = param_obj.get_param(
+            'sale_automatic_workflow.run_retention_days')
+        try:
+            return int(days or 30)
+        except ValueError:
+            return 30
+
+    @api.model
+    def log_run(self, date_start, steps):
+        """ Record a run of the job
+
+        :param date_start: datetime of the start of the run
+        :param steps: list of ``StepStats``
+        """
+        step_values = []
+        error_values = []
+        for stats in steps:
+            step_values.append((0, 0, {
+                'name': stats.name,
+                'processed_count': stats.processed,
+                'failure_count': len(stats.errors),
+                'elapsed_time': stats.elapsed,
+                'throughput': (stats.processed / stats.elapsed
+                               if stats.elapsed else 0.),
+            }))
+            for res_model, res_id, message in stats.errors:
+                error_values.append((0, 0, {
+                    'step': stats.name,
+                    'res_model': res_model,
+                    'res_id': res_id,
+                    'message': message,
+                }))
+        return self.create({
+            'date_start': fields.Datetime.to_string(date_start),
+            'elapsed_time': sum(stats.elapsed for stats in steps),
+            'processed_count': sum(stats.processed for stats in steps),
+            'failure_count': sum(len(stats.errors) for stats in steps),
+            'step_ids': step_values,
+            'error_ids': error_values,
+        })
+
+    @api.model
+    def purge_runs(self):
+        """ Delete the runs older than the retention days, called by a
+        daily scheduled action """
+        days = self._get_retention_days()
+        if days > 0:
+            limit = datetime.utcnow() - timedelta(days=days)
+            self.search(
+                [('date_start', '<', fields.Datetime.to_string(limit))]
+            ).unlink()
+        return True
+
+
+class AutomaticWorkflowJobRunStep(models.Model):
+    """ Metrics of a step of a run of the automatic workflow job """
+
+    _name = 'automatic.workflow.job.run.step'
+    _description = 'Automatic Workflow Job Run Step'
+    _order = 'run_id desc, id'
+
+    run_id = fields.Many2one(
+        comodel_name='automatic.workflow.job.run',
+        string='Run',
+        required=True,
+        readonly=True,
+        index=True,
+        ondelete='cascade')
+    date_start = fields.Datetime(
+        related='run_id.date_start',
+        store=True,
+        readonly=True)
+    name = fields.Char(string='Step', required=True, readonly=True)
+    processed_count = fields.Integer(string='Processed', readonly=True)
+    failure_count = fields.Integer(string='Failures', readonly=True)
+    elapsed_time = fields.Float(string='Elapsed Time (s)', readonly=True)
+    throughput = fields.Float(
+        string='Throughput (records/s)', readonly=True,
+        help="Number of records processed per second by the step.")
+
+
+class AutomaticWorkflowJobRunError(models.Model):
+    """ Error raised on a record during a run of the automatic workflow
+    job """
+
+    _name = 'automatic.workflow.job.run.error'
+    _description = 'Automatic Workflow Job Run Error'
+    _order = 'run_id desc, id'
+
+    run_id = fields.Many2one(
+        comodel_name='automatic.workflow.job.run',
+        string='Run',
+        required=True,
+        readonly=True,
+        index=True,
+        ondelete='cascade')
+    step = fields.Char(string='Step', readonly=True)
+    res_model = fields.Char(string='Model', readonly=True)
+    res_id = fields.Integer(string='Record ID', readonly=True)
+    message = fields.Text(string='Error', readonly=True)
@@ -0,0 +1,116 @@
+# -*- encoding: utf-8 -*-
+###############################################################################
+#
+#    sale_automatic_workflow for OpenERP
+#    Copyright (C) 2011 Akretion Sébastien BEAU <sebastien.beau@akretion.com>
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from openerp import models, fields, api
+
+
+class AutomaticWorkflowQueue(models.Model):
+    """ Records waiting to be processed by the automatic workflow job
+
+    The records are added to the queue when they become eligible to an
+    automatic action, so the job only looks at the queued records instead
+    of searching all the draft orders, invoices and pickings.
+    A record leaves the queue once it is no longer pending, usually
+    because it has been processed.
+    """
+
+    _name = 'automatic.workflow.queue'
+    _description = 'Automatic Workflow Queue'
+    _log_access = False
+
+    res_model = fields.Char(string='Model', required=True, index=True)
+    res_id = fields.Integer(string='Record ID', required=True, index=True)
+
+    @api.model
+    def _get_pending_domain(self, model_name):
+        """ Domain of the records waiting for an automatic action """
+        domains = {
+            'sale.order': [
+                ('state', '=', 'draft'),
+                ('workflow_process_id.validate_order', '=', True),
+            ],
+            'account.invoice': [
+                ('state', 'in', ['draft']),
+                ('workflow_process_id.validate_invoice', '=', True),
+            ],
+            'stock.picking': [
+                ('state', 'in', ['draft', 'confirmed', 'assigned']),
+                ('workflow_process_id.validate_picking', '=', True),
+            ],
+        }
+        return list(domains[model_name])
+
+    @api.model
+    def enqueue(self, records):
+        """ Add the pending records to the queue """
+        if not records:
+            return
+        pending = records.search(
+            self._get_pending_domain(records._name) +
+            [('id', 'in', records.ids)])
+        if not pending:
+            return
+        self.env.cr.execute(
+            "INSERT INTO automatic_workflow_queue (res_model, res_id) "
+            "SELECT %s, rec_id FROM unnest(%s) AS rec_id "
+            "WHERE NOT EXISTS (SELECT 1 FROM automatic_workflow_queue q "
+            "                  WHERE q.res_model = %s "
+            "                  AND q.res_id = rec_id)",
+            (pending._name, pending.ids, pending._name))
+
+    @api.model
+    def enqueue_pending(self):
+        """ Add to the queue all the pending records, used at the
+        installation of the module """
+        for model_name in ('sale.order', 'account.invoice', 'stock.picking'):
+            model = self.env[model_name]
+            self.enqueue(model.search(self._get_pending_domain(model_name)))
+        return True
+
+    @api.model
+    def _get_queued(self, model_name):
+        """ Return the records of a model in the queue """
+        self.env.cr.execute("SELECT DISTINCT res_id "
+                            "FROM automatic_workflow_queue "
+                            "WHERE res_model = %s", (model_name,))
+        return self.env[model_name].browse(
+            [row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _dequeue_processed(self, records):
+        """ Remove from the queue the records which are no longer pending
+
+        The records which failed or which are not yet eligible, for
+        instance because of the domains added by other modules, stay in the
+        queue and are tried again by the next run of the job.
+        """
+        if not records:
+            return
+        pending = records.search(
+            self._get_pending_domain(records._name) +
+            [('id', 'in', records.ids)])
+        done_ids = set(records.ids) - set(pending.ids)
+        if not done_ids:
+            return
+        self.env.cr.execute("DELETE FROM automatic_workflow_queue "
+                            "WHERE res_model = %s AND res_id IN %s",
+                            (records._name, tuple(done_ids)))
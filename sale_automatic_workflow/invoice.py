@@ -21,7 +21,7 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ###############################################################################
-from openerp import models, fields
+from openerp import models, fields, api
 
 
 class AccountInvoice(models.Model):
@@ -35,3 +35,16 @@ class AccountInvoice(models.Model):
                                 column1='invoice_id',
                                 column2='order_id',
                                 string='Sale Orders')
+
+    @api.model
+    def create(self, vals):
+        invoice = super(AccountInvoice, self).create(vals)
+        self.env['automatic.workflow.queue'].enqueue(invoice)
+        return invoice
+
+    @api.multi
+    def write(self, vals):
+        res = super(AccountInvoice, self).write(vals)
+        if 'state' in vals or 'workflow_process_id' in vals:
+            self.env['automatic.workflow.queue'].enqueue(self)
+        return res
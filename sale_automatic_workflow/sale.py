@@ -29,6 +29,19 @@ class sale_order(models.Model):
                                           string='Automatic Workflow',
                                           ondelete='restrict')
 
+    @api.model
+    def create(self, vals):
+        order = super(sale_order, self).create(vals)
+        self.env['automatic.workflow.queue'].enqueue(order)
+        return order
+
+    @api.multi
+    def write(self, vals):
+        res = super(sale_order, self).write(vals)
+        if 'state' in vals or 'workflow_process_id' in vals:
+            self.env['automatic.workflow.queue'].enqueue(self)
+        return res
+
     def _prepare_invoice(self, cr, uid, order, lines, context=None):
         invoice_vals = super(sale_order, self)._prepare_invoice(
             cr, uid, order, lines, context=context)
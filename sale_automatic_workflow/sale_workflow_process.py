@@ -21,7 +21,7 @@
 #
 ###############################################################################
 
-from openerp import models, fields
+from openerp import models, fields, api
 
 
 class SaleWorkflowProcess(models.Model):
@@ -86,3 +86,21 @@ class SaleWorkflowProcess(models.Model):
     property_journal_id = fields.Many2one(
         comodel_name='account.journal', company_dependent=True,
         string='Sales Journal', help='Set default journal to use on invoice')
+
+    @api.multi
+    def write(self, vals):
+        res = super(SaleWorkflowProcess, self).write(vals)
+        # the records of the workflows become eligible to the actions
+        # which have been activated
+        flags = [('validate_order', 'sale.order'),
+                 ('validate_invoice', 'account.invoice'),
+                 ('validate_picking', 'stock.picking'),
+                 ]
+        queue_obj = self.env['automatic.workflow.queue']
+        for flag, model_name in flags:
+            if vals.get(flag):
+                records = self.env[model_name].search(
+                    queue_obj._get_pending_domain(model_name) +
+                    [('workflow_process_id', 'in', self.ids)])
+                queue_obj.enqueue(records)
+        return res
@@ -25,6 +25,17 @@ from openerp import models, api
 class StockMove(models.Model):
     _inherit = 'stock.move'
 
+    @api.multi
+    def write(self, vals):
+        res = super(StockMove, self).write(vals)
+        if 'state' in vals:
+            # the state of a picking is computed from its moves, it is
+            # never written on the picking itself
+            pickings = self.mapped('picking_id').filtered(
+                'workflow_process_id')
+            self.env['automatic.workflow.queue'].enqueue(pickings)
+        return res
+
     @api.multi
     def _picking_assign(self, procurement_group, location_from, location_to):
         res = super(StockMove, self)._picking_assign(procurement_group,
@@ -19,14 +19,49 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ###############################################################################
+from datetime import datetime, timedelta
+
 from openerp import models, fields, api
 
+# delay before the first retry of a failed automatic validation, doubled
+# after each failure
+RETRY_DELAY = 5  # minutes
+RETRY_MAX_DELAY = 24 * 60  # minutes
+
 
 class StockPicking(models.Model):
     _inherit = "stock.picking"
 
     workflow_process_id = fields.Many2one(comodel_name='sale.workflow.process',
                                           string='Sale Workflow Process')
+    workflow_retry_count = fields.Integer(
+        string='Failed Automatic Validations',
+        readonly=True,
+        copy=False,
+        help="Number of times the automatic validation of the picking "
+             "failed. Once it reaches the system parameter "
+             "sale_automatic_workflow.picking_max_retries (5 by default), "
+             "the picking is no longer validated automatically.")
+    workflow_next_retry = fields.Datetime(
+        string='Next Automatic Validation',
+        readonly=True,
+        copy=False,
+        help="After a failure, the automatic validation of the picking is "
+             "postponed, twice longer after each failure.")
+
+    @api.model
+    def create(self, vals):
+        picking = super(StockPicking, self).create(vals)
+        self.env['automatic.workflow.queue'].enqueue(picking)
+        return picking
+
+    @api.multi
+    def write(self, vals):
+        res = super(StockPicking, self).write(vals)
+        # the pickings whose state changes are queued by their moves
+        if 'workflow_process_id' in vals:
+            self.env['automatic.workflow.queue'].enqueue(self)
+        return res
 
     def _create_invoice_from_picking(self, cr, uid, picking, vals,
                                      context=None):
@@ -38,6 +73,30 @@ class StockPicking(models.Model):
         return _super._create_invoice_from_picking(cr, uid, picking, vals,
                                                    context=context)
 
+    @api.multi
+    def postpone_workflow_validation(self):
+        """ Postpone the next automatic validation of pickings which failed
+        """
+        now = datetime.utcnow()
+        for picking in self:
+            retry_count = picking.workflow_retry_count + 1
+            delay = timedelta(minutes=min(RETRY_DELAY * 2 ** (retry_count - 1),
+                                          RETRY_MAX_DELAY))
+            picking.write({
+                'workflow_retry_count': retry_count,
+                'workflow_next_retry': fields.Datetime.to_string(now + delay),
+            })
+        return True
+
+    @api.multi
+    def reset_workflow_validation(self):
+        """ Validate again automatically pickings postponed or quarantined
+        after failures """
+        self.write({'workflow_retry_count': 0,
+                    'workflow_next_retry': False})
+        self.env['automatic.workflow.queue'].enqueue(self)
+        return True
+
     @api.multi
     def validate_picking(self):
         only_available = self.filtered(
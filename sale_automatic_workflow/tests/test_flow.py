@@ -21,7 +21,8 @@
 
 from datetime import datetime, timedelta
 
-from openerp import fields
+from openerp import api, fields
+from openerp.exceptions import Warning as UserError
 from openerp.tests import common
 
 
@@ -199,3 +200,143 @@ class TestAutomaticWorkflow(common.TransactionCase):
         self.assertTrue(sale.invoice_ids)
         invoice = sale.invoice_ids
         self.assertEqual(invoice.journal_id.id, new_sale_journal.id)
+
+    def test_run_log(self):
+        workflow = self._create_full_automatic()
+        sale = self._create_sale_order(workflow)
+        sale.onchange_workflow_process_id()
+        self.progress()
+        run = self.env['automatic.workflow.job.run'].search([], limit=1)
+        self.assertTrue(run)
+        steps = dict((step.name, step) for step in run.step_ids)
+        self.assertIn('sale_order', steps)
+        self.assertIn('invoice', steps)
+        self.assertIn('picking', steps)
+        self.assertEqual(steps['sale_order'].processed_count, 1)
+        self.assertEqual(steps['sale_order'].failure_count, 0)
+        self.assertFalse(run.error_ids)
+
+    def test_idle_run_not_logged(self):
+        run_obj = self.env['automatic.workflow.job.run']
+        workflow = self._create_full_automatic()
+        sale = self._create_sale_order(workflow)
+        sale.onchange_workflow_process_id()
+        self.progress()
+        self.progress()
+        # the order, its invoice and its picking are processed
+        runs = run_obj.search([])
+        self.progress()
+        self.assertEqual(run_obj.search([]), runs)
+
+    def test_purge_runs(self):
+        run_obj = self.env['automatic.workflow.job.run']
+        old_date = datetime.utcnow() - timedelta(days=60)
+        old_run = run_obj.create(
+            {'date_start': fields.Datetime.to_string(old_date)})
+        recent_run = run_obj.create({'date_start': fields.Datetime.now()})
+        run_obj.purge_runs()
+        self.assertFalse(old_run.exists())
+        self.assertTrue(recent_run.exists())
+
+    def test_queue_on_workflow_activation(self):
+        workflow = self._create_full_automatic(
+            override={'validate_order': False})
+        sale = self._create_sale_order(workflow)
+        sale.onchange_workflow_process_id()
+        queue_obj = self.env['automatic.workflow.queue']
+        self.assertNotIn(sale, queue_obj._get_queued('sale.order'))
+        workflow.validate_order = True
+        self.assertIn(sale, queue_obj._get_queued('sale.order'))
+        self.progress()
+        self.assertEqual(sale.state, 'progress')
+        self.assertNotIn(sale, queue_obj._get_queued('sale.order'))
+
+    def test_queue_picking_when_ready(self):
+        workflow = self._create_full_automatic()
+        product = self.env['product.product'].create({'name': 'Bread',
+                                                      'type': 'product'})
+        stock = self.env.ref('stock.stock_location_stock')
+        picking = self.env['stock.picking'].create({
+            'picking_type_id': self.env.ref('stock.picking_type_out').id,
+            'workflow_process_id': workflow.id,
+            'move_lines': [(0, 0, {
+                'name': product.name,
+                'product_id': product.id,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': 1,
+                'location_id': stock.id,
+                'location_dest_id':
+                    self.env.ref('stock.stock_location_customers').id,
+            })],
+        })
+        # the picking waits for the reception of the product
+        reception = self.env['stock.move'].create({
+            'name': product.name,
+            'product_id': product.id,
+            'product_uom': product.uom_id.id,
+            'product_uom_qty': 1,
+            'location_id': self.env.ref('stock.stock_location_suppliers').id,
+            'location_dest_id': stock.id,
+            'move_dest_id': picking.move_lines.id,
+        })
+        reception.action_confirm()
+        picking.action_confirm()
+        self.assertEqual(picking.state, 'waiting')
+        self.progress()
+        queue_obj = self.env['automatic.workflow.queue']
+        self.assertNotIn(picking, queue_obj._get_queued('stock.picking'))
+        reception.action_done()
+        self.assertEqual(picking.state, 'assigned')
+        self.assertIn(picking, queue_obj._get_queued('stock.picking'))
+        self.progress()
+        self.assertEqual(picking.state, 'done')
+
+    def _make_transfer_fail(self, sale):
+        """ Make the transfer of the pickings of ``sale`` fail """
+        picking_class = type(self.env['stock.picking'])
+        do_transfer = picking_class.do_transfer
+
+        @api.multi
+        def failing_do_transfer(pickings, *args, **kwargs):
+            if any(picking.origin == sale.name for picking in pickings):
+                raise UserError('Transfer failure')
+            return do_transfer(pickings, *args, **kwargs)
+
+        picking_class.do_transfer = failing_do_transfer
+        # the method is inherited, removing the patch restores it
+        self.addCleanup(self._restore_transfer)
+
+    def _restore_transfer(self):
+        picking_class = type(self.env['stock.picking'])
+        if 'do_transfer' in vars(picking_class):
+            del picking_class.do_transfer
+
+    def test_picking_postponed_after_failure(self):
+        self.env['ir.config_parameter'].set_param(
+            'sale_automatic_workflow.batch_size', '10')
+        workflow = self._create_full_automatic()
+        sales = [self._create_sale_order(workflow) for __ in range(3)]
+        for sale in sales:
+            sale.onchange_workflow_process_id()
+        failing_sale = sales[1]
+        self._make_transfer_fail(failing_sale)
+        # the orders are confirmed, then their pickings are validated in
+        # the same batch
+        self.progress()
+        failing_picking = failing_sale.picking_ids
+        self.assertNotEqual(failing_picking.state, 'done')
+        self.assertEqual(failing_picking.workflow_retry_count, 1)
+        self.assertTrue(failing_picking.workflow_next_retry)
+        for sale in sales:
+            if sale == failing_sale:
+                continue
+            self.assertEqual(sale.picking_ids.state, 'done')
+            self.assertEqual(sale.picking_ids.workflow_retry_count, 0)
+        # postponed
+        self._restore_transfer()
+        self.progress()
+        self.assertNotEqual(failing_picking.state, 'done')
+        failing_picking.reset_workflow_validation()
+        self.assertEqual(failing_picking.workflow_retry_count, 0)
+        self.progress()
+        self.assertEqual(failing_picking.state, 'done')
@@ -53,8 +53,9 @@ both for odoo and OCB).
 **Warning:**
 
 The second test is a workaround to compensate the lack of
-stock reservation process in OpenERP. This can be a performance killer
-and should not be be used if you have hundreds of simultaneous open SO.
+stock reservation process in OpenERP. The virtual stock at every future date
+is computed with a single query per product and location, but the test still
+has a cost with many simultaneous open SO.
 """,
  'website': 'http://www.camptocamp.com',
  'data': ["data/data.xml"],
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    Author: Nicolas Bessi, Leonardo Pistone
+#    Copyright 2013, 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+from openerp import models, api, tools
+
+
+class ProcurementRule(models.Model):
+    _inherit = 'procurement.rule'
+
+    @tools.ormcache(skiparg=2)
+    def _predict_rule_ids(self, cr, uid, warehouse_id, location_ids,
+                          procurement_route_ids, product_route_ids,
+                          warehouse_route_ids):
+        """Search the rules a procurement would use, without a procurement.
+
+        The result is cached in the registry until a rule, a route or a
+        location is modified.
+
+        :param location_ids: tuple of the destination location and its
+                             parents
+        :return: tuple of rule ids, sorted by priority
+
+        """
+        domain = [('location_id', 'in', location_ids)]
+        if warehouse_id:
+            domain += [
+                '|',
+                ('warehouse_id', '=', warehouse_id),
+                ('warehouse_id', '=', False)
+            ]
+
+        res = self.search(
+            cr, uid,
+            domain + [('route_id', 'in', procurement_route_ids)],
+            order='route_sequence, sequence'
+        )
+        if not res:
+            res = self.search(
+                cr, uid,
+                domain + [('route_id', 'in', product_route_ids)],
+                order='route_sequence, sequence'
+            )
+            if not res:
+                res = warehouse_route_ids and self.search(
+                    cr, uid,
+                    domain + [('route_id', 'in', warehouse_route_ids)],
+                    order='route_sequence, sequence'
+                ) or []
+                if not res:
+                    res = self.search(
+                        cr, uid,
+                        domain + [('route_id', '=', False)],
+                        order='sequence'
+                    )
+        return tuple(res)
+
+    @api.model
+    def create(self, vals):
+        rule = super(ProcurementRule, self).create(vals)
+        self.clear_caches()
+        return rule
+
+    @api.multi
+    def write(self, vals):
+        res = super(ProcurementRule, self).write(vals)
+        self.clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(ProcurementRule, self).unlink()
+        self.clear_caches()
+        return res
+
+
+class StockLocationRoute(models.Model):
+    _inherit = 'stock.location.route'
+
+    @api.model
+    def create(self, vals):
+        route = super(StockLocationRoute, self).create(vals)
+        self.env['procurement.rule'].clear_caches()
+        return route
+
+    @api.multi
+    def write(self, vals):
+        res = super(StockLocationRoute, self).write(vals)
+        self.env['procurement.rule'].clear_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(StockLocationRoute, self).unlink()
+        self.env['procurement.rule'].clear_caches()
+        return res
+
+
+class StockLocation(models.Model):
+    _inherit = 'stock.location'
+
+    @tools.ormcache(skiparg=2)
+    def _get_ancestor_map(self, cr, uid):
+        """Return the ancestors of every location.
+
+        The map is built with a single query on the nested set of the
+        locations and cached in the registry until a location is modified.
+
+        :return: dict {location_id: tuple of the ids of the location and
+                 its parents, from the location up to the root}
+
+        """
+        cr.execute("SELECT l.id, p.id "
+                   "FROM stock_location l "
+                   "JOIN stock_location p "
+                   "  ON p.parent_left <= l.parent_left "
+                   "  AND p.parent_right > l.parent_left "
+                   "ORDER BY l.id, p.parent_left DESC")
+        ancestors = {}
+        for location_id, parent_id in cr.fetchall():
+            ancestors.setdefault(location_id, []).append(parent_id)
+        return dict((location_id, tuple(parent_ids))
+                    for location_id, parent_ids in ancestors.iteritems())
+
+    @api.model
+    def _clear_location_caches(self):
+        self.clear_caches()
+        self.env['procurement.rule'].clear_caches()
+
+    @api.model
+    def create(self, vals):
+        location = super(StockLocation, self).create(vals)
+        self._clear_location_caches()
+        return location
+
+    @api.multi
+    def write(self, vals):
+        res = super(StockLocation, self).write(vals)
+        self._clear_location_caches()
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(StockLocation, self).unlink()
+        self._clear_location_caches()
+        return res
@@ -19,9 +19,13 @@
 #
 #
 import datetime
+from bisect import bisect_right
+
 from openerp import models, fields, api
 from openerp.tools.translate import _
 
+from .stock import get_virtual_qty_cache
+
 
 class SaleOrderLine(models.Model):
 
@@ -48,11 +52,8 @@ class SaleOrderLine(models.Model):
     def _find_parent_locations(self):
         location = self.order_id.partner_shipping_id.property_stock_customer
 
-        res = [location.id]
-        while location.location_id:
-            location = location.location_id
-            res.append(location.id)
-        return res
+        ancestor_map = self.env['stock.location']._get_ancestor_map()
+        return list(ancestor_map.get(location.id, (location.id,)))
 
     @api.multi
     def _predict_rules(self):
@@ -61,6 +62,10 @@ class SaleOrderLine(models.Model):
         This imitates what will be done when the order is validated, with the
         difference that here we do not have a procurement yet.
 
+        The rules are searched once for a given warehouse, set of routes and
+        destination location, then cached until a rule, a route or a
+        location is modified.
+
         """
         Rule = self.env['procurement.rule']
         Warehouse = self.env['stock.warehouse']
@@ -72,14 +77,8 @@ class SaleOrderLine(models.Model):
 
         warehouse = Warehouse.browse(procurement_data['warehouse_id'])
 
-        domain = [('location_id', 'in', self._find_parent_locations())]
         warehouse_route_ids = []
         if warehouse:
-            domain += [
-                '|',
-                ('warehouse_id', '=', warehouse.id),
-                ('warehouse_id', '=', False)
-            ]
             warehouse_route_ids = [x.id for x in warehouse.route_ids]
 
         product_route_ids = [
@@ -87,25 +86,14 @@ class SaleOrderLine(models.Model):
             for x in self.product_id.route_ids +
             self.product_id.categ_id.total_route_ids]
         procurement_route_ids = [x.id for x in self.route_id]
-        res = Rule.search(
-            domain + [('route_id', 'in', procurement_route_ids)],
-            order='route_sequence, sequence'
+        rule_ids = Rule._predict_rule_ids(
+            warehouse.id,
+            tuple(self._find_parent_locations()),
+            tuple(procurement_route_ids),
+            tuple(product_route_ids),
+            tuple(warehouse_route_ids),
         )
-
-        if not res:
-            res = Rule.search(
-                domain + [('route_id', 'in', product_route_ids)],
-                order='route_sequence, sequence'
-            )
-            if not res:
-                res = warehouse_route_ids and Rule.search(
-                    domain + [('route_id', 'in', warehouse_route_ids)],
-                    order='route_sequence, sequence'
-                ) or []
-                if not res:
-                    res = Rule.search(domain + [('route_id', '=', False)],
-                                      order='sequence')
-        return res
+        return Rule.browse(rule_ids)
 
     @api.multi
     def _get_line_location(self):
@@ -132,16 +120,71 @@ class SaleOrderLine(models.Model):
     def _should_skip_stock_checks(self):
         self.ensure_one()
 
-        if (
+        if not (
             self.product_id and
             self.product_id.type == 'product' and
-            self._is_make_to_stock() and
-            self._get_line_location() and
-            self._get_line_location().usage == 'internal'
+            self._is_make_to_stock()
         ):
-            return False
-        else:
             return True
+        location = self._get_line_location()
+        return not (location and location.usage == 'internal')
+
+    @api.multi
+    def _get_virtual_qty(self, location, to_date):
+        """Virtual quantity of the product of the line at a date, in the
+        location and its children, for the stock owner of the line if any.
+
+        The quantities are cached for the transaction, until a stock move of
+        the product is created or modified.
+
+        """
+        self.ensure_one()
+        ctx = {
+            'to_date': to_date,
+            'compute_child': True,
+            'location': location.id,
+            }
+
+        try:
+            ctx['owner_id'] = self.stock_owner_id.id
+        except AttributeError:
+            # module sale_owner_stock_sourcing not installed, fine
+            pass
+
+        cache = get_virtual_qty_cache(self.env)
+        product_cache = cache.setdefault(self.product_id.id, {})
+        key = (location.id, ctx.get('owner_id'), to_date)
+        if key not in product_cache:
+            product_cache[key] = (self.product_id
+                                  .with_context(ctx)
+                                  .virtual_available)
+        return product_cache[key]
+
+    @api.multi
+    def _get_virtual_qty_timeline(self, location):
+        """Evolution of the virtual quantity of the product of the line in
+        the location and its children, for the stock owner of the line if
+        any.
+
+        The timeline is cached like the virtual quantities.
+
+        :return: list of (date, virtual quantity at this date)
+
+        """
+        self.ensure_one()
+        try:
+            owner_id = self.stock_owner_id.id
+        except AttributeError:
+            # module sale_owner_stock_sourcing not installed, fine
+            owner_id = False
+
+        cache = get_virtual_qty_cache(self.env)
+        product_cache = cache.setdefault(self.product_id.id, {})
+        key = ('timeline', location.id, owner_id)
+        if key not in product_cache:
+            product_cache[key] = self.product_id._get_virtual_qty_timeline(
+                location, owner_id=owner_id)
+        return product_cache[key]
 
     @api.multi
     def can_command_at_delivery_date(self):
@@ -164,22 +207,9 @@ class SaleOrderLine(models.Model):
 
         assert location, _("No rules specifies a location"
                            " for this sale order line")
-        ctx = {
-            'to_date': delivery_date,
-            'compute_child': True,
-            'location': location.id,
-            }
-
-        try:
-            ctx['owner_id'] = self.stock_owner_id.id
-        except AttributeError:
-            # module sale_owner_stock_sourcing not installed, fine
-            pass
 
         # Virtual qty is made on all childs of chosen location
-        prod_for_virtual_qty = (self.product_id
-                                .with_context(ctx)
-                                .virtual_available)
+        prod_for_virtual_qty = self._get_virtual_qty(location, delivery_date)
         if prod_for_virtual_qty < self.product_uom_qty:
             return False
         return True
@@ -221,8 +251,8 @@ class SaleOrderLine(models.Model):
         """Predicate function that is a naive workaround for the lack of stock
         reservation.
 
-        This can be a performance killer, you should not use it
-        if you have constantly a lot of running Orders
+        The virtual quantities at the affected dates are read from a
+        timeline computed with a single query.
 
         :return: True if future order are affected by current command line
         """
@@ -235,25 +265,20 @@ class SaleOrderLine(models.Model):
         assert location, _("No rules specifies a location"
                            " for this sale order line")
 
-        ctx = {
-            'compute_child': True,
-            'location_id': location.id,
-            }
-
-        try:
-            ctx['owner_id'] = self.stock_owner_id.id
-        except AttributeError:
-            # module sale_owner_stock_sourcing not installed, fine
-            pass
-
+        dates = set(self._get_affected_dates(location.id, self.product_id.id,
+                                             delivery_date))
+        if not dates:
+            return False
         # Virtual qty is made on all childs of chosen location
-        dates = self._get_affected_dates(location.id, self.product_id.id,
-                                         delivery_date)
-        for aff_date in dates:
-            ctx['to_date'] = aff_date
-            prod_for_virtual_qty = (self.product_id
-                                    .with_context(ctx)
-                                    .virtual_available)
+        timeline = self._get_virtual_qty_timeline(location)
+        # the first point of the timeline is the current stock
+        timeline_dates = [date for date, __ in timeline[1:]]
+        for date in dates:
+            # the quantity at a date is the one of the last point of the
+            # timeline at or before it, the date itself may not be a point
+            # when its moves do not leave the location and its children
+            index = bisect_right(timeline_dates, date)
+            prod_for_virtual_qty = timeline[index][1]
             if prod_for_virtual_qty < self.product_uom_qty:
                 return True
         return False
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    Author: Nicolas Bessi, Leonardo Pistone
+#    Copyright 2013, 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+from openerp import models, api
+
+
+# fields of the stock moves changing the virtual quantities
+VIRTUAL_QTY_FIELDS = ('state', 'product_id', 'product_uom_qty', 'product_uom',
+                      'date', 'date_expected', 'location_id',
+                      'location_dest_id')
+
+
+def _drop_cache_at_transaction_end(cr, caches):
+    """Drop the cache of the cursor from ``caches`` when its transaction
+    is committed or rolled back."""
+    if getattr(cr, '_virtual_qty_caches', None) is caches:
+        return
+    cr._virtual_qty_caches = caches
+
+    def wrap(method):
+        def end_transaction(*args, **kwargs):
+            caches.pop(cr, None)
+            return method(*args, **kwargs)
+        return end_transaction
+
+    cr.commit = wrap(cr.commit)
+    cr.rollback = wrap(cr.rollback)
+
+
+def get_virtual_qty_cache(env):
+    """Return the cache of the virtual quantities computed by the stock
+    exceptions.
+
+    The cache is shared by the environments of the current request, like
+    the cache of the records. It is a dict {product_id: {key: value}},
+    where key is (location_id, owner_id, to_date) for a virtual quantity,
+    or ('timeline', location_id, owner_id) for a virtual quantity timeline.
+
+    The cache is bound to the cursor of ``env`` and dropped when its
+    transaction is committed or rolled back, as the quantities may have
+    been changed by other transactions or rolled back meanwhile.
+
+    """
+    try:
+        caches = env.all.virtual_qty_caches
+    except AttributeError:
+        caches = env.all.virtual_qty_caches = {}
+    cache = caches.get(env.cr)
+    if cache is None:
+        _drop_cache_at_transaction_end(env.cr, caches)
+        cache = caches[env.cr] = {}
+    return cache
+
+
+def invalidate_virtual_qty_cache(env, product_ids):
+    caches = getattr(env.all, 'virtual_qty_caches', None)
+    cache = caches.get(env.cr) if caches else None
+    if not cache:
+        return
+    for product_id in product_ids:
+        cache.pop(product_id, None)
+
+
+class ProductProduct(models.Model):
+    _inherit = 'product.product'
+
+    @api.multi
+    def _get_virtual_qty_timeline(self, location, owner_id=False):
+        """Return the evolution of the virtual quantity of the product in a
+        location and its children.
+
+        The result is computed with a single query on the quants and the
+        moves, which are aggregated by date. It gives the same quantities
+        as the ``virtual_available`` field computed with the ``to_date``
+        context key for each date.
+
+        :param location: the location, its children are included
+        :param owner_id: when set, only the stock of this owner is counted
+        :return: list of (date, virtual quantity at this date), sorted by
+                 date, the first date being None for the current stock
+
+        """
+        self.ensure_one()
+        in_location = ("%s.parent_left >= %%(parent_left)s "
+                       "AND %s.parent_left < %%(parent_right)s")
+        params = {
+            'product_id': self.id,
+            'parent_left': location.parent_left,
+            'parent_right': location.parent_right,
+            'states': ('done', 'cancel', 'draft'),
+            'owner_id': owner_id,
+        }
+        quant_owner = move_owner = ''
+        if owner_id:
+            quant_owner = "AND q.owner_id = %(owner_id)s"
+            move_owner = "AND m.restrict_partner_id = %(owner_id)s"
+        sql = ("SELECT NULL AS date, SUM(q.qty) "
+               "FROM stock_quant q "
+               "JOIN stock_location ql ON ql.id = q.location_id "
+               "WHERE q.product_id = %(product_id)s "
+               "  AND " + in_location % ('ql', 'ql') + " " + quant_owner +
+               " UNION ALL "
+               "SELECT m.date, "
+               "       SUM(CASE WHEN " + in_location % ('dl', 'dl') +
+               "                THEN m.product_qty "
+               "                ELSE -m.product_qty END) "
+               "FROM stock_move m "
+               "JOIN stock_location sl ON sl.id = m.location_id "
+               "JOIN stock_location dl ON dl.id = m.location_dest_id "
+               "WHERE m.product_id = %(product_id)s "
+               "  AND m.state NOT IN %(states)s "
+               "  AND (" + in_location % ('sl', 'sl') + ") "
+               "      <> (" + in_location % ('dl', 'dl') + ") " +
+               move_owner +
+               " GROUP BY m.date "
+               "ORDER BY date NULLS FIRST")
+        self.env.cr.execute(sql, params)
+        timeline = []
+        qty = 0.
+        for date, move_qty in self.env.cr.fetchall():
+            qty += move_qty or 0.
+            timeline.append((date, qty))
+        return timeline
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    @api.model
+    def create(self, vals):
+        move = super(StockMove, self).create(vals)
+        invalidate_virtual_qty_cache(self.env, [move.product_id.id])
+        return move
+
+    @api.multi
+    def write(self, vals):
+        if not any(field in vals for field in VIRTUAL_QTY_FIELDS):
+            return super(StockMove, self).write(vals)
+        # when the product changes, the former product is affected too
+        product_ids = set(self.mapped('product_id').ids)
+        res = super(StockMove, self).write(vals)
+        product_ids.update(self.mapped('product_id').ids)
+        invalidate_virtual_qty_cache(self.env, product_ids)
+        return res
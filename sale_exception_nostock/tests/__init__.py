@@ -1 +1,5 @@
 from . import test_dropshipping_skip_check
+from . import test_virtual_qty_cache
+from . import test_virtual_qty_timeline
+from . import test_location_ancestors
+from . import test_future_orders_affected
@@ -0,0 +1,59 @@
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+from datetime import datetime
+
+from openerp.tests.common import TransactionCase
+
+
+class TestFutureOrdersAffected(TransactionCase):
+    def setUp(self):
+        """Set up a sale order line with a mocked stock timeline."""
+        super(TestFutureOrdersAffected, self).setUp()
+        location = self.env.ref('stock.stock_location_stock')
+        self.order_line = self.env['sale.order.line'].new()
+        self.order_line._should_skip_stock_checks = lambda: False
+        self.order_line._compute_line_delivery_date = lambda: (
+            datetime(2030, 2, 1),)
+        self.order_line._get_line_location = lambda: location
+        self.order_line._get_virtual_qty_timeline = lambda location: [
+            (None, 10.),
+            ('2030-03-01 00:00:00', 6.),
+            ('2030-03-20 00:00:00', 3.),
+        ]
+
+    def _set_affected_dates(self, *dates):
+        self.order_line._get_affected_dates = lambda *args: iter(dates)
+
+    def test_date_between_timeline_points(self):
+        # moves inside the location are not points of the timeline
+        self._set_affected_dates('2030-03-10 00:00:00')
+        self.order_line.product_uom_qty = 5.
+        self.assertIs(False, self.order_line.future_orders_are_affected())
+        self.order_line.product_uom_qty = 7.
+        self.assertIs(True, self.order_line.future_orders_are_affected())
+
+    def test_date_before_timeline_points(self):
+        self._set_affected_dates('2030-02-15 00:00:00')
+        self.order_line.product_uom_qty = 9.
+        self.assertIs(False, self.order_line.future_orders_are_affected())
+        self.order_line.product_uom_qty = 11.
+        self.assertIs(True, self.order_line.future_orders_are_affected())
+
+    def test_date_on_timeline_point(self):
+        self._set_affected_dates('2030-03-01 00:00:00',
+                                 '2030-03-20 00:00:00')
+        self.order_line.product_uom_qty = 3.
+        self.assertIs(False, self.order_line.future_orders_are_affected())
+        self.order_line.product_uom_qty = 4.
+        self.assertIs(True, self.order_line.future_orders_are_affected())
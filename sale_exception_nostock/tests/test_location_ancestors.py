@@ -0,0 +1,41 @@
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from openerp.tests.common import TransactionCase
+
+
+class TestLocationAncestors(TransactionCase):
+    def _walk_parents(self, location):
+        res = [location.id]
+        while location.location_id:
+            location = location.location_id
+            res.append(location.id)
+        return tuple(res)
+
+    def test_ancestors_match_parents(self):
+        Location = self.env['stock.location']
+        ancestor_map = Location._get_ancestor_map()
+        for location in Location.search([]):
+            self.assertEqual(self._walk_parents(location),
+                             ancestor_map[location.id])
+
+    def test_new_location_refreshes_map(self):
+        Location = self.env['stock.location']
+        Location._get_ancestor_map()
+        customers = self.env.ref('stock.stock_location_customers')
+        location = Location.create({'name': 'Shop Customers',
+                                    'usage': 'customer',
+                                    'location_id': customers.id})
+        self.assertEqual(self._walk_parents(location),
+                         Location._get_ancestor_map()[location.id])
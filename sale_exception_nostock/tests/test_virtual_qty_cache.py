@@ -0,0 +1,94 @@
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from openerp.tests.common import TransactionCase
+
+from ..model.stock import (get_virtual_qty_cache,
+                           invalidate_virtual_qty_cache)
+
+
+class TestVirtualQtyCache(TransactionCase):
+    def setUp(self):
+        super(TestVirtualQtyCache, self).setUp()
+        self.product = self.env['product.product'].create({
+            'name': 'Firesteel',
+            'type': 'product',
+        })
+        self.cache = get_virtual_qty_cache(self.env)
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+
+    def _create_move(self):
+        return self.env['stock.move'].create({
+            'name': 'Firesteel',
+            'product_id': self.product.id,
+            'product_uom': self.product.uom_id.id,
+            'product_uom_qty': 1.,
+            'location_id': self.env.ref('stock.stock_location_stock').id,
+            'location_dest_id': self.env.ref(
+                'stock.stock_location_customers').id,
+        })
+
+    def test_move_creation_invalidates_cache(self):
+        self._create_move()
+        self.assertNotIn(self.product.id, self.cache)
+
+    def test_move_state_change_invalidates_cache(self):
+        move = self._create_move()
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+        move.action_confirm()
+        self.assertNotIn(self.product.id, self.cache)
+
+    def test_other_write_keeps_cache(self):
+        move = self._create_move()
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+        move.name = 'Firesteel again'
+        self.assertIn(self.product.id, self.cache)
+
+    def test_product_change_invalidates_cache(self):
+        move = self._create_move()
+        other = self.env['product.product'].create({
+            'name': 'Tinder',
+            'type': 'product',
+        })
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+        self.cache[other.id] = {('stock', None, '2015-01-01'): 12.}
+        move.product_id = other
+        self.assertNotIn(self.product.id, self.cache)
+        self.assertNotIn(other.id, self.cache)
+
+    def test_quantity_change_invalidates_cache(self):
+        move = self._create_move()
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+        move.product_uom_qty = 2.
+        self.assertNotIn(self.product.id, self.cache)
+
+    def test_location_change_invalidates_cache(self):
+        move = self._create_move()
+        self.cache[self.product.id] = {('stock', None, '2015-01-01'): 42.}
+        move.location_dest_id = self.env.ref('stock.stock_location_suppliers')
+        self.assertNotIn(self.product.id, self.cache)
+
+    def test_cache_bound_to_transaction(self):
+        self.assertIs(get_virtual_qty_cache(self.env), self.cache)
+        # a savepoint does not end the transaction
+        self.cr.execute('SAVEPOINT test_virtual_qty_cache')
+        self.cr.execute('ROLLBACK TO SAVEPOINT test_virtual_qty_cache')
+        self.assertIs(get_virtual_qty_cache(self.env), self.cache)
+        self.cr.rollback()
+        self.assertEqual(get_virtual_qty_cache(self.env), {})
+
+    def test_invalidate_without_cache(self):
+        self.cr.rollback()
+        invalidate_virtual_qty_cache(self.env, [self.product.id])
+        self.assertNotIn(self.cr, self.env.all.virtual_qty_caches)
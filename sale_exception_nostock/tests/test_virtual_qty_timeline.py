@@ -0,0 +1,62 @@
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from openerp.tests.common import TransactionCase
+
+
+class TestVirtualQtyTimeline(TransactionCase):
+    def setUp(self):
+        super(TestVirtualQtyTimeline, self).setUp()
+        self.stock = self.env.ref('stock.stock_location_stock')
+        self.customers = self.env.ref('stock.stock_location_customers')
+        self.suppliers = self.env.ref('stock.stock_location_suppliers')
+        self.product = self.env['product.product'].create({
+            'name': 'Firesteel',
+            'type': 'product',
+        })
+        self.env['stock.quant'].create({
+            'product_id': self.product.id,
+            'location_id': self.stock.id,
+            'qty': 10.,
+        })
+        self._create_move(self.stock, self.customers, 4., '2030-03-01')
+        self._create_move(self.suppliers, self.stock, 5., '2030-03-10')
+        self._create_move(self.stock, self.customers, 8., '2030-03-20')
+
+    def _create_move(self, source, dest, qty, date):
+        move = self.env['stock.move'].create({
+            'name': 'Firesteel',
+            'product_id': self.product.id,
+            'product_uom': self.product.uom_id.id,
+            'product_uom_qty': qty,
+            'location_id': source.id,
+            'location_dest_id': dest.id,
+            'date': date,
+            'date_expected': date,
+        })
+        move.action_confirm()
+        return move
+
+    def test_timeline(self):
+        timeline = self.product._get_virtual_qty_timeline(self.stock)
+        self.assertEqual([qty for __, qty in timeline], [10., 6., 11., 3.])
+
+    def test_timeline_matches_virtual_available(self):
+        timeline = self.product._get_virtual_qty_timeline(self.stock)
+        for date, qty in timeline[1:]:
+            ctx = {'to_date': date,
+                   'compute_child': True,
+                   'location': self.stock.id}
+            self.assertAlmostEqual(
+                qty, self.product.with_context(ctx).virtual_available)
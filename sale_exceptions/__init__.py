@@ -23,5 +23,6 @@
 #
 #
 
+from . import sale_exception_stat
 from . import sale
 from . import wizard
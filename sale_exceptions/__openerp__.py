@@ -35,6 +35,36 @@ the base_sale_multi_channels module, because it's likely a few orders have
 errors when you import them (like product not found in Odoo, wrong line
 format etc...)
 
+An exception rule is either a Python code evaluated on each order or line,
+or a domain on the orders or lines. The domain rules are resolved with one
+search for all the checked orders, so prefer them for simple predicates.
+
+A rule can declare the fields of the order and of the lines it depends on.
+Such a rule is evaluated again on an order only when one of these fields has
+been modified since the last check, otherwise its previous result is kept.
+
+The number of evaluations and the time spent in each rule are collected and
+shown in Sales > Configuration > Exception Rules Statistics. Set the system
+parameter ``sale_exceptions.slow_rule_threshold`` to a duration in
+milliseconds to log the evaluations of rules slower than it.
+
+When the workflow checks if an order can be confirmed, the rules which find
+exceptions at the lowest cost according to these statistics are evaluated
+first, and the evaluation of an order stops once a rule flagged as blocking
+has fired on it.
+
+The scheduled action "Test Draft Orders" can check the orders by batches,
+each batch committed in its own transaction, so an order which cannot be
+checked is left aside without rolling back the other batches. Set its
+arguments to ``(batch_size,)``, for instance ``(500,)``.
+
+An optional second argument sets a number of workers, ``(500, 2)`` for
+instance. The workers are threads, each one with its own database cursor:
+they only overlap the queries of the batches, as the rules are evaluated one
+at a time by the Python interpreter. They do not make the evaluation of the
+python rules faster, so keep the default of one worker unless the checks
+mostly wait on the database.
+
 Contributors
 ------------
 
@@ -20,13 +20,70 @@
 #
 #
 
+import logging
+import threading
 import time
+from Queue import Queue, Empty
+from types import CodeType
 
-from openerp import api, models, fields
-from openerp.exceptions import except_orm
-from openerp.tools.safe_eval import safe_eval
+from openerp import api, models, fields, tools
+from openerp.exceptions import except_orm, ValidationError
+from openerp.tools.safe_eval import safe_eval, test_expr, _SAFE_OPCODES
+from openerp.tools.misc import split_every
 from openerp.tools.translate import _
 
+from .sale_exception_stat import get_profiler
+
+_logger = logging.getLogger(__name__)
+
+
+def _get_safe_builtins():
+    """ Return the restricted builtins installed by ``safe_eval``
+
+    ``safe_eval`` does not accept precompiled code objects, so we grab
+    the builtins it sets up in order to run the cached code objects in
+    the very same sandbox.
+    """
+    space = {}
+    safe_eval('None', space, mode='exec', nocopy=True)
+    return space['__builtins__']
+
+SAFE_BUILTINS = _get_safe_builtins()
+
+
+def _check_dunder_names(code_obj):
+    """ Refuse the access to the dunder names, in the code and in the
+    functions it defines, they give a way out of the sandbox """
+    for name in code_obj.co_names:
+        if name.startswith('__') and name.endswith('__'):
+            raise ValueError("Access to forbidden name '%s'" % name)
+    for const in code_obj.co_consts:
+        if isinstance(const, CodeType):
+            _check_dunder_names(const)
+
+
+def _compile_rule_code(code):
+    """ Compile the python code of a rule with the checks of ``safe_eval``
+
+    ``test_expr`` only checks the opcodes, ``safe_eval`` also refuses
+    ``__subclasses__``, and the names of the dunder attributes are refused
+    as well since the compiled code is not run by ``safe_eval``.
+    """
+    code = code or ''
+    if '__subclasses__' in code:
+        raise ValueError("Access to forbidden name '__subclasses__'")
+    code_obj = test_expr(code, _SAFE_OPCODES, mode='exec')
+    _check_dunder_names(code_obj)
+    return code_obj
+
+
+def _insert_exception_rows(cr, table, rows):
+    """ Insert (sale_order_id, exception_id) rows in a relation table """
+    for sub_rows in split_every(cr.IN_MAX, rows):
+        cr.execute("INSERT INTO %s (sale_order_id, exception_id) VALUES %s" %
+                   (table, ', '.join(['(%s, %s)'] * len(sub_rows))),
+                   [value for row in sub_rows for value in row])
+
 
 class SaleException(models.Model):
     _name = 'sale.exception'
@@ -43,6 +100,24 @@ class SaleException(models.Model):
          ('sale.order.line', 'Sale Order Line')],
         string='Apply on', required=True)
     active = fields.Boolean('Active')
+    blocking = fields.Boolean(
+        'Blocking',
+        help="When the confirmation of an order is checked, the other "
+             "rules are not evaluated on the order once this rule has "
+             "fired on it.")
+    exception_type = fields.Selection(
+        [('by_py_code', 'By Python Code'),
+         ('by_domain', 'By Domain')],
+        string='Exception Type', required=True, default='by_py_code',
+        help="By python code: the exception is detected by a python code "
+             "evaluated on each record.\n"
+             "By domain: the exception is detected by a search with the "
+             "domain, which is resolved in SQL for all the records at once.")
+    domain = fields.Char(
+        'Domain',
+        help="Domain on the model the exception applies on. The records "
+             "matching the domain are in exception.",
+        default='[]')
     code = fields.Text(
         'Python Code',
         help="Python code executed to check if the exception apply or "
@@ -66,22 +141,136 @@ class SaleException(models.Model):
         'sale_order_exception_rel', 'exception_id', 'sale_order_id',
         string='Sale Orders',
         readonly=True)
+    trigger_field_ids = fields.Many2many(
+        'ir.model.fields',
+        'sale_exception_trigger_field_rel', 'exception_id', 'field_id',
+        string='Trigger Fields',
+        domain=[('model', 'in', ('sale.order', 'sale.order.line'))],
+        help="Fields of the sale order or of its lines the rule depends "
+             "on. When set, the rule is evaluated again on an order only "
+             "when one of these fields has been modified since the last "
+             "check. When empty, the rule is evaluated on every check.")
+
+    @tools.ormcache(skiparg=2)
+    def _get_rule_triggers(self, cr, uid):
+        """ Return the rules to check again when a field is modified
+
+        :returns: dict {model: {field_name: set(rule_ids)}}
+        """
+        triggers = {'sale.order': {}, 'sale.order.line': {}}
+        rule_ids = self.search(cr, uid, [('trigger_field_ids', '!=', False)],
+                               context={'active_test': False})
+        for rule in self.browse(cr, uid, rule_ids):
+            for field in rule.trigger_field_ids:
+                model_triggers = triggers.setdefault(field.model, {})
+                model_triggers.setdefault(field.name, set()).add(rule.id)
+        return triggers
+
+    @tools.ormcache(skiparg=3)
+    def _get_compiled_code(self, cr, uid, rule_id, write_date):
+        """ Compile the python code of a rule once per version of the rule
+
+        The compiled code is kept in the registry cache, keyed on the id
+        and the write date of the rule. It is checked with the same
+        restrictions than ``safe_eval``.
+        """
+        rule = self.browse(cr, uid, rule_id)
+        return _compile_rule_code(rule.code)
+
+    @api.one
+    @api.constrains('exception_type', 'code')
+    def _check_code(self):
+        if self.exception_type != 'by_py_code':
+            return
+        try:
+            _compile_rule_code(self.code)
+        except Exception, e:
+            raise ValidationError(
+                _('The python code of the sale exception rule "%s" is '
+                  'not valid:\n%s') % (self.name, e))
+
+    @api.multi
+    def _sorted_by_efficiency(self):
+        """ Sort the rules so the exceptions are found at the lowest cost
+
+        The blocking rules come first as they can stop the evaluation of
+        an order. Then the rules are sorted on their average time divided
+        by their hit ratio, as observed in their statistics. The rules
+        without statistics come first so they get measured.
+        """
+        stats = self.env['sale.exception.stat'].search(
+            [('exception_id', 'in', self.ids)])
+        costs = {}
+        for stat in stats:
+            # smoothed, so a rule which never fired is not infinitely costly
+            costs[stat.exception_id.id] = (stat.average_time *
+                                           (stat.call_count + 1) /
+                                           (stat.hit_count + 1))
+        rules = sorted(self, key=lambda rule: (not rule.blocking,
+                                               costs.get(rule.id, 0.),
+                                               rule.sequence))
+        return self.browse([rule.id for rule in rules])
+
+    @api.model
+    def create(self, vals):
+        rule = super(SaleException, self).create(vals)
+        self.clear_caches()
+        return rule
+
+    @api.multi
+    def write(self, vals):
+        res = super(SaleException, self).write(vals)
+        self.clear_caches()
+        if not self.ids:
+            return res
+        # the rule has changed, the orders must be checked again
+        self.env.cr.execute("DELETE FROM sale_order_exception_checked_rel "
+                            "WHERE exception_id IN %s", (tuple(self.ids),))
+        self.env['sale.order'].invalidate_cache(['exception_checked_ids'])
+        return res
+
+    @api.multi
+    def unlink(self):
+        res = super(SaleException, self).unlink()
+        self.clear_caches()
+        return res
 
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
 
-    _order = 'main_exception_id asc, date_order desc, name desc'
+    # blocked orders first, sorting on main_exception_id would join
+    # sale_exception for each query on the orders
+    _order = 'exception_count desc, date_order desc, name desc'
 
     main_exception_id = fields.Many2one(
         'sale.exception',
         compute='_get_main_error',
         string='Main Exception',
-        store=True)
+        store=True,
+        index=True)
+    exception_count = fields.Integer(
+        compute='_get_main_error',
+        string='Number of Exceptions',
+        store=True,
+        help="Number of exceptions blocking the order in draft.")
+    exception_checked_date = fields.Datetime(
+        string='Exceptions Checked On',
+        readonly=True,
+        copy=False,
+        index=True)
     exception_ids = fields.Many2many(
         'sale.exception',
         'sale_order_exception_rel', 'sale_order_id', 'exception_id',
         string='Exceptions')
+    exception_checked_ids = fields.Many2many(
+        'sale.exception',
+        'sale_order_exception_checked_rel', 'sale_order_id', 'exception_id',
+        string='Up-to-date Exception Checks',
+        readonly=True,
+        copy=False,
+        help="Rules with trigger fields whose last result on this order "
+             "is still valid.")
 
     ignore_exceptions = fields.Boolean('Ignore Exceptions')
 
@@ -90,15 +279,110 @@ class SaleOrder(models.Model):
     def _get_main_error(self):
         if self.state == 'draft' and self.exception_ids:
             self.main_exception_id = self.exception_ids[0]
+            self.exception_count = len(self.exception_ids)
         else:
             self.main_exception_id = False
+            self.exception_count = 0
+
+    def init(self, cr):
+        # the indexes on the relations created by the ORM only cover one
+        # column, these ones cover "orders blocked by a rule" and the
+        # default order of the list views
+        indexes = [
+            ('sale_order_exception_rel_exception_order_index',
+             'sale_order_exception_rel (exception_id, sale_order_id)'),
+            ('sale_order_exception_checked_rel_exception_order_index',
+             'sale_order_exception_checked_rel (exception_id, sale_order_id)'),
+            ('sale_order_exception_order_index',
+             'sale_order (exception_count DESC, date_order DESC, name DESC)'),
+        ]
+        for name, definition in indexes:
+            cr.execute("SELECT indexname FROM pg_indexes "
+                       "WHERE indexname = %s", (name,))
+            if not cr.fetchone():
+                cr.execute('CREATE INDEX %s ON %s' % (name, definition))
 
     @api.model
-    def test_all_draft_orders(self):
+    def test_all_draft_orders(self, batch_size=None, workers=1):
+        """ Check the exceptions of all the draft orders
+
+        :param batch_size: when set, the orders are checked and committed
+                           by batches of this size, in their own
+                           transactions, so a failure only rolls back its
+                           batch
+        :param workers: number of threads checking the batches, each one
+                        with its own cursor. The threads only overlap
+                        their waits on the database: the rules are
+                        evaluated in Python, one thread at a time, so
+                        more than one worker rarely pays off. With one
+                        worker, the batches are checked by the current
+                        thread.
+        """
         order_set = self.search([('state', '=', 'draft')])
-        order_set.test_exceptions()
+        if not batch_size:
+            # all the exceptions are shown on the orders, so no short-circuit
+            order_set.detect_exceptions()
+            return True
+        if workers <= 1:
+            for order_ids in split_every(batch_size, order_set.ids):
+                self._test_orders_batch(order_ids)
+            return True
+        batches = Queue()
+        for order_ids in split_every(batch_size, order_set.ids):
+            batches.put(order_ids)
+        threads = []
+        for index in range(workers):
+            thread = threading.Thread(
+                target=self._test_orders_worker,
+                args=(batches,),
+                name='sale.exception.sweep.%d' % index)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
         return True
 
+    @api.model
+    def _test_orders_worker(self, batches):
+        """ Check the batches of orders of the queue until it is empty """
+        with api.Environment.manage():
+            while True:
+                try:
+                    order_ids = batches.get_nowait()
+                except Empty:
+                    return
+                self._test_orders_batch(order_ids)
+
+    @api.model
+    def _test_orders_batch(self, order_ids):
+        """ Check and commit a batch of orders with a new cursor
+
+        When the batch fails, its orders are checked again one by one so
+        only the failing orders are left aside.
+        """
+        with self.pool.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            try:
+                env['sale.order'].browse(order_ids).detect_exceptions()
+                cr.commit()
+                return
+            except Exception:
+                cr.rollback()
+                if len(order_ids) == 1:
+                    _logger.exception('Error when checking the exceptions '
+                                      'of the sale order %d.', order_ids[0])
+                    return
+            env.invalidate_all()
+            for order_id in order_ids:
+                try:
+                    env['sale.order'].browse(order_id).detect_exceptions()
+                    cr.commit()
+                except Exception:
+                    cr.rollback()
+                    env.invalidate_all()
+                    _logger.exception('Error when checking the exceptions '
+                                      'of the sale order %d.', order_id)
+
     @api.multi
     def _popup_exceptions(self):
         model_data_model = self.env['ir.model.data']
@@ -136,16 +420,20 @@ class SaleOrder(models.Model):
         """
         Condition method for the workflow from draft to confirm
         """
-        if self.detect_exceptions():
+        if self.detect_exceptions(short_circuit=True):
             return False
         return True
 
     @api.multi
-    def detect_exceptions(self):
+    def detect_exceptions(self, short_circuit=False):
         """returns the list of exception_ids for all the considered sale orders
 
         as a side effect, the sale order's exception_ids column is updated with
         the list of exceptions related to the SO
+
+        :param short_circuit: when only the presence of exceptions matters,
+                              stop the evaluation of an order as soon as a
+                              blocking rule fires on it
         """
         exception_obj = self.env['sale.exception']
         order_exceptions = exception_obj.search(
@@ -153,16 +441,131 @@ class SaleOrder(models.Model):
         line_exceptions = exception_obj.search(
             [('model', '=', 'sale.order.line')])
 
+        orders = self.filtered(lambda order: not order.ignore_exceptions)
+        if not orders:
+            return []
+        orders._exception_prefetch()
+        skipped = set()
+        exceptions_by_order = orders._detect_exceptions(
+            order_exceptions, line_exceptions,
+            short_circuit=short_circuit, skipped=skipped)
+        orders._write_exception_ids(exceptions_by_order)
+        orders._write_exception_checked_date()
+        orders._mark_exceptions_checked(
+            (order_exceptions | line_exceptions).filtered('trigger_field_ids'),
+            skipped=skipped)
+        self.env['sale.exception.stat'].flush_stats()
+
         all_exception_ids = []
-        for order in self:
-            if order.ignore_exceptions:
-                continue
-            exception_ids = order._detect_exceptions(order_exceptions,
-                                                     line_exceptions)
-            order.exception_ids = [(6, 0, exception_ids)]
-            all_exception_ids += exception_ids
+        for order in orders:
+            all_exception_ids += exceptions_by_order[order.id]
         return all_exception_ids
 
+    @api.multi
+    def _exception_prefetch(self):
+        """ Load in the cache, in a few queries, the records that the
+        exception rules usually read on the orders and their lines
+        """
+        self.mapped('partner_id.name')
+        self.mapped('partner_shipping_id.zip')
+        self.mapped('order_line.product_id.type')
+        self.mapped('exception_ids')
+        self.mapped('exception_checked_ids')
+
+    @api.multi
+    def _write_exception_ids(self, exceptions_by_order):
+        """ Update the exceptions of the orders with a diff on the relation
+
+        Only the missing rows are inserted and the outdated ones deleted,
+        then the stored fields depending on the exceptions are recomputed
+        for the orders which have changed.
+
+        :param exceptions_by_order: dict {order_id: [exception_ids]}
+        """
+        cr = self.env.cr
+        existing = set()
+        for sub_ids in cr.split_for_in_conditions(self.ids):
+            cr.execute("SELECT sale_order_id, exception_id "
+                       "FROM sale_order_exception_rel "
+                       "WHERE sale_order_id IN %s", (sub_ids,))
+            existing.update(cr.fetchall())
+        expected = set((order_id, exception_id)
+                       for order_id, exception_ids
+                       in exceptions_by_order.iteritems()
+                       for exception_id in exception_ids)
+
+        to_remove = existing - expected
+        to_add = expected - existing
+        for rows in split_every(cr.IN_MAX, to_remove):
+            cr.execute("DELETE FROM sale_order_exception_rel "
+                       "WHERE (sale_order_id, exception_id) IN %s",
+                       (rows,))
+        _insert_exception_rows(cr, 'sale_order_exception_rel', to_add)
+
+        changed_ids = list(set(row[0] for row in to_remove | to_add))
+        if changed_ids:
+            changed = self.browse(changed_ids)
+            changed.invalidate_cache(['exception_ids'], changed_ids)
+            self.env['sale.exception'].invalidate_cache(['sale_order_ids'])
+            changed.modified(['exception_ids'])
+            changed.recompute()
+
+    @api.multi
+    def _write_exception_checked_date(self):
+        cr = self.env.cr
+        for sub_ids in cr.split_for_in_conditions(self.ids):
+            cr.execute("UPDATE sale_order "
+                       "SET exception_checked_date = "
+                       "    now() at time zone 'UTC' "
+                       "WHERE id IN %s", (sub_ids,))
+        self.invalidate_cache(['exception_checked_date'], self.ids)
+
+    @api.multi
+    def _mark_exceptions_checked(self, rules, skipped=()):
+        """ Record that the result of the rules on the orders is up to date
+
+        These (order, rule) pairs will not be evaluated again until one of
+        the trigger fields of the rule is modified.
+
+        :param skipped: (order_id, rule_id) pairs which have not been
+                        evaluated
+        """
+        if not rules:
+            return
+        rows = set((order.id, rule.id) for order in self for rule in rules
+                   if rule not in order.exception_checked_ids and
+                   (order.id, rule.id) not in skipped)
+        _insert_exception_rows(self.env.cr,
+                               'sale_order_exception_checked_rel', rows)
+        self.invalidate_cache(['exception_checked_ids'], self.ids)
+
+    @api.multi
+    def _invalidate_exception_checks(self, rule_ids):
+        """ The rules must be evaluated again on the orders """
+        if not self.ids or not rule_ids:
+            return
+        self.env.cr.execute("DELETE FROM sale_order_exception_checked_rel "
+                            "WHERE sale_order_id IN %s "
+                            "AND exception_id IN %s",
+                            (tuple(self.ids), tuple(rule_ids)))
+        self.invalidate_cache(['exception_checked_ids'], self.ids)
+
+    @api.model
+    def _get_triggered_rule_ids(self, model, field_names):
+        """ Return the ids of the rules depending on the fields """
+        triggers = self.env['sale.exception']._get_rule_triggers()
+        model_triggers = triggers.get(model, {})
+        rule_ids = set()
+        for field_name in field_names:
+            rule_ids |= model_triggers.get(field_name, set())
+        return rule_ids
+
+    @api.multi
+    def write(self, vals):
+        rule_ids = self._get_triggered_rule_ids('sale.order', vals.keys())
+        self._invalidate_exception_checks(rule_ids)
+        return super(SaleOrder, self).write(vals)
+
     @api.model
     def _exception_rule_eval_context(self, obj_name, rec):
         user = self.env['res.users'].browse(self._uid)
@@ -178,40 +581,148 @@ class SaleOrder(models.Model):
                 # copy context to prevent side-effects of eval
                 'context': self._context.copy()}
 
+    @api.model
+    def _rule_profile(self, rule, start, records, hits):
+        """ Record the duration of an evaluation of a rule on ``records``
+        started at ``start`` and log it when the time per record is
+        slower than the threshold
+
+        :param hits: number of records on which the rule has found an
+                     exception
+        """
+        duration = (time.time() - start) * 1000
+        profiler = get_profiler(self.env.cr.dbname)
+        profiler.add(rule.id, duration, hits=hits, count=len(records))
+        if profiler.threshold and \
+                duration / len(records) > profiler.threshold:
+            _logger.warning('Slow sale exception rule "%s" (id %d): '
+                            '%.1f ms on %s',
+                            rule.name, rule.id, duration, records)
+
     @api.model
     def _rule_eval(self, rule, obj_name, rec):
-        expr = rule.code
         space = self._exception_rule_eval_context(obj_name, rec)
+        space['__builtins__'] = dict(SAFE_BUILTINS)
+        start = time.time()
+        try:
+            code = rule._get_compiled_code(rule.id, rule.write_date)
+            eval(code, space)
+        except Exception, e:
+            raise except_orm(
+                _('Error'),
+                _('Error when evaluating the sale exception '
+                  'rule:\n %s \n(%s)') % (rule.name, e))
+        failed = space.get('failed', False)
+        self._rule_profile(rule, start, rec, 1 if failed else 0)
+        return failed
+
+    @api.model
+    def _domain_rule_eval(self, rule, records):
+        """ Return the records matching the domain of a rule
+
+        The domain is resolved with a single search restricted to the
+        given records.
+        """
+        if not records:
+            return records
+        start = time.time()
         try:
-            safe_eval(expr,
-                      space,
-                      mode='exec',
-                      nocopy=True)  # nocopy allows to return 'result'
+            domain = safe_eval(rule.domain or '[]')
+            failed = records.search(domain + [('id', 'in', records.ids)])
         except Exception, e:
             raise except_orm(
                 _('Error'),
                 _('Error when evaluating the sale exception '
                   'rule:\n %s \n(%s)') % (rule.name, e))
-        return space.get('failed', False)
+        self._rule_profile(rule, start, records, len(failed))
+        return failed
 
     @api.multi
     def _detect_exceptions(self, order_exceptions,
-                           line_exceptions):
-        self.ensure_one()
-        exception_ids = []
-        for rule in order_exceptions:
-            if self._rule_eval(rule, 'order', self):
+                           line_exceptions, short_circuit=False,
+                           skipped=None):
+        """ Evaluate each rule over the whole recordset
+
+        The rules are only evaluated on the orders where their last result
+        is no longer up to date, the previous result is kept for the
+        other orders.
+
+        In ``short_circuit`` mode, the rules which find exceptions at the
+        lowest cost are evaluated first, and the evaluation of an order
+        stops as soon as a blocking rule fires on it. The previous result
+        is kept for the rules which have not been evaluated.
+
+        :param skipped: set filled with the (order_id, rule_id) pairs
+                        which have not been evaluated
+        :returns: dict {order_id: [exception_ids]}
+        """
+        if short_circuit:
+            order_exceptions = order_exceptions._sorted_by_efficiency()
+            line_exceptions = line_exceptions._sorted_by_efficiency()
+        if skipped is None:
+            skipped = set()
+        exceptions_by_order = dict((order.id, []) for order in self)
+        remaining = self
+        for rule in list(order_exceptions) + list(line_exceptions):
+            for order in self - remaining:
+                skipped.add((order.id, rule.id))
+                if rule in order.exception_ids:
+                    exceptions_by_order[order.id].append(rule.id)
+
+            orders = remaining._exception_keep_checked(rule,
+                                                       exceptions_by_order)
+            if rule.model == 'sale.order':
+                self._detect_order_exceptions(rule, orders,
+                                              exceptions_by_order)
+            else:
+                self._detect_line_exceptions(rule, orders,
+                                             exceptions_by_order)
+            if short_circuit and rule.blocking:
+                remaining = remaining.filtered(
+                    lambda order: rule.id not in exceptions_by_order[order.id])
+        return exceptions_by_order
+
+    @api.model
+    def _detect_order_exceptions(self, rule, orders, exceptions_by_order):
+        if rule.exception_type == 'by_domain':
+            failed = self._domain_rule_eval(rule, orders)
+        else:
+            failed = orders.filtered(
+                lambda order: self._rule_eval(rule, 'order', order))
+        for order in failed:
+            exceptions_by_order[order.id].append(rule.id)
+
+    @api.model
+    def _detect_line_exceptions(self, rule, orders, exceptions_by_order):
+        order_lines = orders.mapped('order_line')
+        if rule.exception_type == 'by_domain':
+            failed = self._domain_rule_eval(rule, order_lines)
+            for order in failed.mapped('order_id'):
+                exceptions_by_order[order.id].append(rule.id)
+            return
+        for order_line in order_lines:
+            exception_ids = exceptions_by_order[order_line.order_id.id]
+            if rule.id in exception_ids:
+                # we do not matter if the exception as already been
+                # found for an order line of this order
+                continue
+            if self._rule_eval(rule, 'line', order_line):
                 exception_ids.append(rule.id)
 
-        for order_line in self.order_line:
-            for rule in line_exceptions:
-                if rule.id in exception_ids:
-                    # we do not matter if the exception as already been
-                    # found for an order line of this order
-                    continue
-                if self._rule_eval(rule, 'line', order_line):
-                    exception_ids.append(rule.id)
-        return exception_ids
+    @api.multi
+    def _exception_keep_checked(self, rule, exceptions_by_order):
+        """ Keep the previous result of a rule on the orders where it is
+        still up to date
+
+        :returns: the orders on which the rule must be evaluated
+        """
+        to_check_ids = []
+        for order in self:
+            if rule not in order.exception_checked_ids:
+                to_check_ids.append(order.id)
+            elif rule in order.exception_ids:
+                exceptions_by_order[order.id].append(rule.id)
+        return self.browse(to_check_ids)
 
     @api.one
     def copy(self, default=None):
@@ -221,3 +732,44 @@ class SaleOrder(models.Model):
             'ignore_exceptions': False,
         })
         return super(SaleOrder, self).copy(default=default)
+
+
+class SaleOrderLine(models.Model):
+    _inherit = 'sale.order.line'
+
+    @api.model
+    def _get_order_triggered_rule_ids(self, field_names=None):
+        """ Return the ids of the rules to evaluate again on the order when
+        lines are modified, only on ``field_names`` if given, or created
+        or deleted.
+        """
+        order_model = self.env['sale.order']
+        rule_ids = order_model._get_triggered_rule_ids('sale.order',
+                                                       ['order_line'])
+        if field_names is None:
+            triggers = self.env['sale.exception']._get_rule_triggers()
+            for line_rule_ids in triggers.get('sale.order.line', {}).values():
+                rule_ids |= line_rule_ids
+        else:
+            rule_ids |= order_model._get_triggered_rule_ids('sale.order.line',
+                                                            field_names)
+        return rule_ids
+
+    @api.model
+    def create(self, vals):
+        line = super(SaleOrderLine, self).create(vals)
+        rule_ids = self._get_order_triggered_rule_ids()
+        line.order_id._invalidate_exception_checks(rule_ids)
+        return line
+
+    @api.multi
+    def write(self, vals):
+        rule_ids = self._get_order_triggered_rule_ids(vals.keys())
+        self.mapped('order_id')._invalidate_exception_checks(rule_ids)
+        return super(SaleOrderLine, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        rule_ids = self._get_order_triggered_rule_ids()
+        self.mapped('order_id')._invalidate_exception_checks(rule_ids)
+        return super(SaleOrderLine, self).unlink()
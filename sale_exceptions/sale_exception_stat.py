@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    OpenERP, Open Source Management Solution
+#    Authors: Raphaël Valyi, Renato Lima
+#    Copyright (C) 2011 Akretion LTDA.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import logging
+import threading
+import time
+
+from openerp import api, models, fields
+
+_logger = logging.getLogger(__name__)
+
+
+class RuleProfiler(object):
+    """ Statistics of the evaluations of the exception rules
+
+    The statistics are collected in memory by each process and flushed
+    periodically in ``sale.exception.stat``.
+    """
+
+    flush_interval = 60  # seconds
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        # flush at the first check to load the threshold
+        self.last_flush = 0
+        self.threshold = 0.
+
+    def add(self, rule_id, duration, hits=0, count=1):
+        """ Record the evaluations of a rule
+
+        :param duration: duration of the evaluations in milliseconds
+        :param hits: number of records on which the rule has found an
+                     exception
+        :param count: number of records evaluated, a domain rule is
+                      evaluated on several records with one search
+        """
+        with self.lock:
+            stat = self.stats.setdefault(rule_id, [0, 0., 0., 0])
+            stat[0] += count
+            stat[1] += duration
+            stat[2] = max(stat[2], duration / count)
+            stat[3] += hits
+
+    def pop(self, force=False):
+        """ Return and reset the collected statistics when they are due
+        for a flush
+
+        :returns: dict {rule_id: [call_count, total_time, max_time,
+                                  hit_count]}
+        """
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_flush < self.flush_interval:
+                return {}
+            stats, self.stats = self.stats, {}
+            self.last_flush = now
+            return stats
+
+
+# one profiler per database
+profilers = {}
+profilers_lock = threading.Lock()
+
+
+def get_profiler(dbname):
+    with profilers_lock:
+        if dbname not in profilers:
+            profilers[dbname] = RuleProfiler()
+        return profilers[dbname]
+
+
+class SaleExceptionStat(models.Model):
+    _name = 'sale.exception.stat'
+    _description = "Sale Exception Rule Statistics"
+    _order = 'total_time desc'
+    _rec_name = 'exception_id'
+
+    exception_id = fields.Many2one(
+        'sale.exception',
+        string='Exception Rule',
+        required=True,
+        readonly=True,
+        ondelete='cascade')
+    model = fields.Selection(
+        related='exception_id.model',
+        readonly=True)
+    call_count = fields.Integer('Evaluations', readonly=True)
+    total_time = fields.Float(
+        'Cumulative Time (ms)', readonly=True,
+        help="Time spent in the evaluations of the rule.")
+    max_time = fields.Float('Max Time (ms)', readonly=True)
+    average_time = fields.Float('Average Time (ms)', readonly=True)
+    hit_count = fields.Integer(
+        'Hits', readonly=True,
+        help="Number of evaluations which have found an exception.")
+    hit_ratio = fields.Float('Hit Ratio (%)', readonly=True)
+
+    _sql_constraints = [
+        ('exception_uniq', 'unique(exception_id)',
+         'Only one statistics line per exception rule.'),
+    ]
+
+    @api.model
+    def flush_stats(self, force=False):
+        """ Write the statistics collected in memory by the current process
+
+        The statistics are written with a dedicated cursor, so the
+        transaction checking the orders does not hold locks on them.
+        Unless ``force`` is True, the statistics are written at most once
+        per ``RuleProfiler.flush_interval``.
+        """
+        profiler = get_profiler(self.env.cr.dbname)
+        stats = profiler.pop(force=force)
+        if not stats:
+            return
+        param_obj = self.env['ir.config_parameter']
+        threshold = param_obj.get_param('sale_exceptions.slow_rule_threshold')
+        try:
+            profiler.threshold = float(threshold or 0)
+        except ValueError:
+            profiler.threshold = 0.
+        with self.pool.cursor() as cr:
+            try:
+                self._write_stats(cr, stats)
+            except Exception:
+                # statistics are not worth failing the checks of the orders
+                cr.rollback()
+                _logger.exception('Could not write the statistics of the '
+                                  'sale exception rules.')
+
+    @api.model
+    def _write_stats(self, cr, stats):
+        for rule_id, (count, total, maximum, hits) in stats.iteritems():
+            cr.execute("UPDATE sale_exception_stat "
+                       "SET call_count = call_count + %s, "
+                       "    total_time = total_time + %s, "
+                       "    max_time = GREATEST(max_time, %s), "
+                       "    average_time = (total_time + %s) / "
+                       "                   (call_count + %s), "
+                       "    hit_count = hit_count + %s, "
+                       "    hit_ratio = 100.0 * (hit_count + %s) / "
+                       "                (call_count + %s), "
+                       "    write_uid = %s, "
+                       "    write_date = now() at time zone 'UTC' "
+                       "WHERE exception_id = %s",
+                       (count, total, maximum, total, count, hits, hits,
+                        count, self.env.uid, rule_id))
+            if cr.rowcount:
+                continue
+            # the rule may have been deleted meanwhile
+            cr.execute("INSERT INTO sale_exception_stat "
+                       "(exception_id, call_count, total_time, max_time, "
+                       " average_time, hit_count, hit_ratio, "
+                       " create_uid, create_date, write_uid, write_date) "
+                       "SELECT id, %s, %s, %s, %s, %s, %s, "
+                       "       %s, now() at time zone 'UTC', "
+                       "       %s, now() at time zone 'UTC' "
+                       "FROM sale_exception WHERE id = %s",
+                       (count, total, maximum, total / count, hits,
+                        100.0 * hits / count, self.env.uid, self.env.uid,
+                        rule_id))
+
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from openerp.tests.common import TransactionCase
+
+
+class SaleExceptionCase(TransactionCase):
+
+    def setUp(self):
+        super(SaleExceptionCase, self).setUp()
+        self.rule_model = self.env['sale.exception']
+        # only the rules of the tests are evaluated
+        self.rule_model.search([]).write({'active': False})
+        self.partner = self.env['res.partner'].create({'name': 'Customer'})
+        self.product = self.env['product.product'].create({
+            'name': 'Firesteel',
+        })
+        self.order_rule = self.rule_model.create({
+            'name': 'Blocked reference',
+            'sequence': 10,
+            'model': 'sale.order',
+            'active': True,
+            'exception_type': 'by_py_code',
+            'code': "failed = order.client_order_ref == 'block'",
+        })
+        self.line_rule = self.rule_model.create({
+            'name': 'Large quantity',
+            'sequence': 20,
+            'model': 'sale.order.line',
+            'active': True,
+            'exception_type': 'by_domain',
+            'domain': "[('product_uom_qty', '>', 10)]",
+        })
+
+    def _create_order(self, client_order_ref=False, qty=1.):
+        return self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'pricelist_id': self.env.ref('product.list0').id,
+            'client_order_ref': client_order_ref,
+            'order_line': [(0, 0, {
+                'name': self.product.name,
+                'product_id': self.product.id,
+                'product_uom_qty': qty,
+                'price_unit': 10.,
+            })],
+        })
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from .common import SaleExceptionCase
+
+
+class TestDetectExceptions(SaleExceptionCase):
+
+    def assertExceptions(self, order, rules):
+        self.assertEqual(order.exception_ids, rules)
+        self.assertEqual(order.exception_count, len(rules))
+        self.assertEqual(order.main_exception_id, rules[:1])
+
+    def test_exceptions_added(self):
+        blocked = self._create_order(client_order_ref='block')
+        large = self._create_order(qty=20.)
+        both = self._create_order(client_order_ref='block', qty=20.)
+        valid = self._create_order()
+        orders = blocked | large | both | valid
+        orders.detect_exceptions()
+        self.assertExceptions(blocked, self.order_rule)
+        self.assertExceptions(large, self.line_rule)
+        # the main exception is the one with the lowest sequence
+        self.assertExceptions(both, self.order_rule | self.line_rule)
+        self.assertExceptions(valid, self.rule_model.browse())
+
+    def test_exceptions_removed(self):
+        fixed = self._create_order(client_order_ref='block', qty=20.)
+        unchanged = self._create_order(client_order_ref='block', qty=20.)
+        orders = fixed | unchanged
+        orders.detect_exceptions()
+        self.assertExceptions(fixed, self.order_rule | self.line_rule)
+        fixed.client_order_ref = 'fixed'
+        orders.detect_exceptions()
+        self.assertExceptions(fixed, self.line_rule)
+        self.assertExceptions(unchanged, self.order_rule | self.line_rule)
+        fixed.order_line.product_uom_qty = 5.
+        orders.detect_exceptions()
+        self.assertExceptions(fixed, self.rule_model.browse())
+        self.assertExceptions(unchanged, self.order_rule | self.line_rule)
+
+    def test_ignore_exceptions(self):
+        ignored = self._create_order(client_order_ref='block')
+        ignored.ignore_exceptions = True
+        blocked = self._create_order(client_order_ref='block')
+        (ignored | blocked).detect_exceptions()
+        self.assertExceptions(ignored, self.rule_model.browse())
+        self.assertExceptions(blocked, self.order_rule)
+
+    def test_line_rule_on_one_order(self):
+        large = self._create_order(qty=20.)
+        large.order_line.copy({'order_id': large.id, 'product_uom_qty': 1.})
+        small = self._create_order(qty=1.)
+        small.order_line.copy({'order_id': small.id, 'product_uom_qty': 2.})
+        exception_ids = (large | small).detect_exceptions()
+        self.assertEqual(exception_ids, [self.line_rule.id])
+        self.assertExceptions(large, self.line_rule)
+        self.assertExceptions(small, self.rule_model.browse())
+
+    def test_all_draft_orders(self):
+        # a blocking rule stops the evaluation of the order in the workflow
+        # condition, but the sweep shows all the exceptions
+        self.order_rule.blocking = True
+        order = self._create_order(client_order_ref='block', qty=20.)
+        self.assertFalse(order.test_exceptions())
+        self.assertExceptions(order, self.order_rule)
+        self.env['sale.order'].test_all_draft_orders()
+        self.assertExceptions(order, self.order_rule | self.line_rule)
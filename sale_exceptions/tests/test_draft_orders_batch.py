@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from itertools import count
+
+from .common import SaleExceptionCase
+
+
+class SavepointCursor(object):
+    """ Cursor sharing the transaction of the test, its commits and
+    rollbacks are done on a savepoint, so the batches see the data of the
+    test and their work is rolled back with it
+    """
+
+    sequence = count()
+
+    def __init__(self, cr):
+        self._cr = cr
+        self._savepoint = 'test_batch_%d' % next(self.sequence)
+        self._cr.execute('SAVEPOINT "%s"' % self._savepoint)
+
+    def __getattr__(self, name):
+        return getattr(self._cr, name)
+
+    def commit(self):
+        self._cr.execute('RELEASE SAVEPOINT "%s"' % self._savepoint)
+        self._cr.execute('SAVEPOINT "%s"' % self._savepoint)
+
+    def rollback(self):
+        self._cr.execute('ROLLBACK TO SAVEPOINT "%s"' % self._savepoint)
+
+    def close(self):
+        self._cr.execute('RELEASE SAVEPOINT "%s"' % self._savepoint)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        self.close()
+
+
+class TestDraftOrdersBatch(SaleExceptionCase):
+
+    def setUp(self):
+        super(TestDraftOrdersBatch, self).setUp()
+        self.crash_rule = self.rule_model.create({
+            'name': 'Crash',
+            'sequence': 30,
+            'model': 'sale.order',
+            'active': True,
+            'exception_type': 'by_py_code',
+            'code': "failed = 1 / 0 if order.client_order_ref == 'crash' "
+                    "else False",
+        })
+        # the batches are checked with new cursors, which would not see
+        # the records of the test
+        self.registry.cursor = lambda *args: SavepointCursor(self.cr)
+        self.addCleanup(delattr, self.registry, 'cursor')
+
+    def test_failing_order_left_aside(self):
+        blocked = self._create_order(client_order_ref='block')
+        crash = self._create_order(client_order_ref='crash')
+        valid = self._create_order()
+        orders = blocked | crash | valid
+        self.env['sale.order']._test_orders_batch(orders.ids)
+        self.env.invalidate_all()
+        self.assertEqual(blocked.exception_ids, self.order_rule)
+        self.assertTrue(blocked.exception_checked_date)
+        self.assertFalse(valid.exception_ids)
+        self.assertTrue(valid.exception_checked_date)
+        # the check of the failing order has been rolled back
+        self.assertFalse(crash.exception_checked_date)
+
+    def test_batches(self):
+        blocked = self._create_order(client_order_ref='block')
+        crash = self._create_order(client_order_ref='crash')
+        valid = self._create_order(qty=20.)
+        self.env['sale.order'].test_all_draft_orders(batch_size=2)
+        self.env.invalidate_all()
+        self.assertEqual(blocked.exception_ids, self.order_rule)
+        self.assertEqual(valid.exception_ids, self.line_rule)
+        self.assertFalse(crash.exception_checked_date)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from .common import SaleExceptionCase
+
+
+class TestExceptionChecks(SaleExceptionCase):
+
+    def setUp(self):
+        super(TestExceptionChecks, self).setUp()
+        fields_model = self.env['ir.model.fields']
+        self.ref_field = fields_model.search(
+            [('model', '=', 'sale.order'), ('name', '=', 'client_order_ref')])
+        self.qty_field = fields_model.search(
+            [('model', '=', 'sale.order.line'),
+             ('name', '=', 'product_uom_qty')])
+        # reads the note but only declares the reference as trigger, so
+        # a stale result shows that the previous result has been kept
+        self.note_rule = self.rule_model.create({
+            'name': 'Blocked note',
+            'sequence': 30,
+            'model': 'sale.order',
+            'active': True,
+            'exception_type': 'by_py_code',
+            'code': "failed = order.note == 'block'",
+            'trigger_field_ids': [(6, 0, self.ref_field.ids)],
+        })
+        self.qty_rule = self.rule_model.create({
+            'name': 'Very large quantity',
+            'sequence': 40,
+            'model': 'sale.order.line',
+            'active': True,
+            'exception_type': 'by_py_code',
+            'code': "failed = line.product_uom_qty > 100",
+            'trigger_field_ids': [(6, 0, self.qty_field.ids)],
+        })
+        self.order = self._create_order()
+        self.order.detect_exceptions()
+
+    def assertChecked(self, rules):
+        self.assertEqual(self.order.exception_checked_ids, rules)
+
+    def test_rules_checked(self):
+        self.assertChecked(self.note_rule | self.qty_rule)
+
+    def test_keep_previous_result(self):
+        self.order.note = 'block'
+        self.order.detect_exceptions()
+        # the note is not a trigger field of the rule
+        self.assertNotIn(self.note_rule, self.order.exception_ids)
+        self.order.client_order_ref = 'changed'
+        self.assertChecked(self.qty_rule)
+        self.order.detect_exceptions()
+        self.assertIn(self.note_rule, self.order.exception_ids)
+        self.order.note = 'fixed'
+        self.order.detect_exceptions()
+        # still the previous result, the reference has not been modified
+        self.assertIn(self.note_rule, self.order.exception_ids)
+        self.assertChecked(self.note_rule | self.qty_rule)
+
+    def test_order_write_other_field(self):
+        self.order.note = 'not a trigger'
+        self.assertChecked(self.note_rule | self.qty_rule)
+
+    def test_line_write(self):
+        self.order.order_line.name = 'not a trigger'
+        self.assertChecked(self.note_rule | self.qty_rule)
+        self.order.order_line.product_uom_qty = 200.
+        self.assertChecked(self.note_rule)
+        self.order.detect_exceptions()
+        self.assertIn(self.qty_rule, self.order.exception_ids)
+
+    def test_line_create(self):
+        self.order.order_line.copy({'order_id': self.order.id,
+                                    'product_uom_qty': 200.})
+        self.assertChecked(self.note_rule)
+        self.order.detect_exceptions()
+        self.assertIn(self.qty_rule, self.order.exception_ids)
+
+    def test_line_unlink(self):
+        line = self.order.order_line.copy({'order_id': self.order.id,
+                                           'product_uom_qty': 200.})
+        self.order.detect_exceptions()
+        self.assertIn(self.qty_rule, self.order.exception_ids)
+        line.unlink()
+        self.assertChecked(self.note_rule)
+        self.order.detect_exceptions()
+        self.assertNotIn(self.qty_rule, self.order.exception_ids)
+
+    def test_rule_write(self):
+        self.qty_rule.write({'sequence': 50})
+        self.assertChecked(self.note_rule)
+
+    def test_rule_write_empty(self):
+        self.rule_model.browse().write({'sequence': 50})
+        self.assertChecked(self.note_rule | self.qty_rule)
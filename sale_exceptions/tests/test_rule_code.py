@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from openerp.exceptions import ValidationError
+
+from .common import SaleExceptionCase
+
+
+class TestRuleCode(SaleExceptionCase):
+
+    def _create_rule(self, code):
+        return self.rule_model.create({
+            'name': 'Sandbox',
+            'model': 'sale.order',
+            'active': True,
+            'exception_type': 'by_py_code',
+            'code': code,
+        })
+
+    def test_subclasses_refused(self):
+        with self.assertRaises(ValidationError):
+            self._create_rule(
+                "failed = ().__class__.__bases__[0].__subclasses__()")
+
+    def test_dunder_attribute_refused(self):
+        with self.assertRaises(ValidationError):
+            self._create_rule("failed = order.__class__")
+        with self.assertRaises(ValidationError):
+            self.order_rule.code = "failed = (lambda: order.__class__)()"
+
+    def test_rule_code_accepted(self):
+        rule = self._create_rule("failed = order.client_order_ref == 'x'")
+        order = self._create_order(client_order_ref='x')
+        order.detect_exceptions()
+        self.assertIn(rule, order.exception_ids)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from ..sale_exception_stat import get_profiler
+from .common import SaleExceptionCase
+
+
+class TestRuleProfile(SaleExceptionCase):
+
+    def setUp(self):
+        super(TestRuleProfile, self).setUp()
+        self.profiler = get_profiler(self.env.cr.dbname)
+        # drop the statistics collected before the test
+        self.profiler.pop(force=True)
+        self.orders = (self._create_order(client_order_ref='block') |
+                       self._create_order() |
+                       self._create_order())
+
+    def _get_stat(self, rule):
+        count, total, maximum, hits = self.profiler.stats[rule.id]
+        return count, hits
+
+    def test_domain_rule(self):
+        lines = self.orders.mapped('order_line')
+        lines[0].product_uom_qty = 20.
+        failed = self.orders._domain_rule_eval(self.line_rule, lines)
+        self.assertEqual(failed, lines[0])
+        # one search, but one evaluation per line
+        self.assertEqual(self._get_stat(self.line_rule), (3, 1))
+
+    def test_domain_rule_no_records(self):
+        lines = self.env['sale.order.line'].browse()
+        failed = self.orders._domain_rule_eval(self.line_rule, lines)
+        self.assertFalse(failed)
+        self.assertNotIn(self.line_rule.id, self.profiler.stats)
+
+    def test_python_rule(self):
+        for order in self.orders:
+            self.orders._rule_eval(self.order_rule, 'order', order)
+        self.assertEqual(self._get_stat(self.order_rule), (3, 1))
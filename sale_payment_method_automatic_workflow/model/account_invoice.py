@@ -19,12 +19,73 @@
 #
 ##############################################################################
 
-from openerp import models, api
+from openerp import models, fields, api
 
 
 class AccountInvoice(models.Model):
     _inherit = 'account.invoice'
 
+    reconcile_checked_date = fields.Datetime(
+        string='Last Automatic Reconciliation Attempt',
+        readonly=True,
+        copy=False,
+        help="The automatic workflow does not try again to reconcile the "
+             "invoice with the payments of its sales orders until the "
+             "invoice or its payments are modified.")
+
+    @api.model
+    def _get_reconcile_candidates(self):
+        """ Return the open customer invoices which may be reconciled with
+        the payments of their sales orders
+
+        The invoices must have unreconciled payments on their sales orders,
+        and they are skipped when neither them nor their payments have
+        been modified since the last attempt to reconcile them.
+        """
+        sale_field = self._fields['sale_ids']
+        payment_field = self.env['sale.order']._fields['payment_ids']
+        query = """
+            SELECT inv.id
+            FROM account_invoice inv
+            JOIN {sale_rel} sale_rel ON sale_rel.{sale_inv_col} = inv.id
+            JOIN {payment_rel} payment_rel
+                ON payment_rel.{payment_sale_col} = sale_rel.{sale_col}
+            JOIN account_move_line payment
+                ON payment.id = payment_rel.{payment_col}
+            WHERE inv.state = 'open'
+            AND inv.type = 'out_invoice'
+            AND inv.move_id IS NOT NULL
+            AND payment.reconcile_id IS NULL
+            GROUP BY inv.id
+            HAVING inv.reconcile_checked_date IS NULL
+            OR inv.reconcile_checked_date <
+               GREATEST(inv.write_date, MAX(payment.write_date))
+            ORDER BY inv.id
+        """.format(sale_rel=sale_field.relation,
+                   sale_inv_col=sale_field.column1,
+                   sale_col=sale_field.column2,
+                   payment_rel=payment_field.relation,
+                   payment_sale_col=payment_field.column1,
+                   payment_col=payment_field.column2)
+        self.env.cr.execute(query)
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.multi
+    def _mark_reconcile_checked(self):
+        """ Remember that the invoices could not be reconciled with their
+        current payments
+
+        Written in SQL so the write date of the invoices, used to detect
+        their changes, is not modified.
+        """
+        if not self:
+            return
+        self.env.cr.execute("UPDATE account_invoice "
+                            "SET reconcile_checked_date = "
+                            "    now() at time zone 'UTC' "
+                            "WHERE id IN %s", (tuple(self.ids),))
+        self.invalidate_cache(['reconcile_checked_date'], self.ids)
+
     @api.multi
     @api.returns('account.move.line')
     def _get_payment(self):
@@ -81,18 +142,32 @@ class AccountInvoice(models.Model):
         return res
 
     @api.multi
-    def _prepare_write_off(self, res_invoice, res_payment):
+    def _prepare_write_off(self, res_invoice, res_payment, cache=None):
+        """ Prepare the arguments of the reconciliation with a write-off
+
+        :param cache: optional dict shared between the invoices of a batch,
+                      so the write-off accounts and the periods are only
+                      searched once per company and per date
+        """
         self.ensure_one()
+        if cache is None:
+            cache = {}
         if res_invoice['total_amount'] - res_payment['total_amount'] > 0:
             writeoff_type = 'expense'
         else:
             writeoff_type = 'income'
-        writeoff_info = self.company_id.get_write_off_information
-        account_id, journal_id = writeoff_info('exchange', writeoff_type)
+        key = ('writeoff', self.company_id.id, writeoff_type)
+        if key not in cache:
+            writeoff_info = self.company_id.get_write_off_information
+            cache[key] = writeoff_info('exchange', writeoff_type)
+        account_id, journal_id = cache[key]
         max_date = max(res_invoice['max_date'], res_payment['max_date'])
         ctx_vals = {'p_date': max_date}
-        period_model = self.env['account.period'].with_context(**ctx_vals)
-        period = period_model.find(max_date)[0]
+        key = ('period', self.company_id.id, max_date)
+        if key not in cache:
+            period_model = self.env['account.period'].with_context(**ctx_vals)
+            cache[key] = period_model.find(max_date)[0]
+        period = cache[key]
         return {
             'type': 'auto',
             'writeoff_acc_id': account_id,
@@ -118,37 +193,97 @@ class AccountInvoice(models.Model):
         return True
 
     @api.multi
-    def _reconcile_invoice(self):
+    def _prepare_reconcile(self, write_off_cache=None):
+        """ Match the move lines of the invoice with its payments
+
+        :returns: tuple (lines to reconcile, keyword arguments of
+                  ``reconcile()``, context values) or None when the
+                  invoice cannot be reconciled
+        """
         self.ensure_one()
         company_currency = self.company_id.currency_id
         currency = self.currency_id
         use_currency = currency != company_currency
-        if self._can_be_reconciled():
-            payment_move_lines = self._get_payment()
-            res_payment = self._get_sum_payment_move_line(payment_move_lines,
-                                                          self.type)
-            res_invoice = self._get_sum_invoice_move_line(self.move_id.line_id,
-                                                          self.type)
-            lines = res_invoice['lines'] + res_payment['lines']
-            if not self._lines_can_be_reconciled(lines):
-                return
-            if not use_currency:
-                balance = abs(res_invoice['total_amount'] -
-                              res_payment['total_amount'])
-                if lines and currency.is_zero(balance):
-                    lines.reconcile()
-            else:
-                balance = abs(res_invoice['total_amount_currency'] -
-                              res_payment['total_amount_currency'])
-                if lines and currency.is_zero(balance):
-                    kwargs = self._prepare_write_off(res_invoice, res_payment)
-                    ctx_vals = kwargs.pop('context_vals')
-                    lines.with_context(**ctx_vals).reconcile(**kwargs)
+        if not self._can_be_reconciled():
+            return None
+        payment_move_lines = self._get_payment()
+        res_payment = self._get_sum_payment_move_line(payment_move_lines,
+                                                      self.type)
+        res_invoice = self._get_sum_invoice_move_line(self.move_id.line_id,
+                                                      self.type)
+        lines = res_invoice['lines'] + res_payment['lines']
+        if not self._lines_can_be_reconciled(lines):
+            return None
+        if not use_currency:
+            balance = abs(res_invoice['total_amount'] -
+                          res_payment['total_amount'])
+            if lines and currency.is_zero(balance):
+                return lines, {}, {}
+        else:
+            balance = abs(res_invoice['total_amount_currency'] -
+                          res_payment['total_amount_currency'])
+            if lines and currency.is_zero(balance):
+                kwargs = self._prepare_write_off(res_invoice, res_payment,
+                                                 cache=write_off_cache)
+                ctx_vals = kwargs.pop('context_vals')
+                return lines, kwargs, ctx_vals
+        return None
+
+    @api.multi
+    def _reconcile_invoice(self):
+        """ Reconcile the invoice with the payments of its sales order
+
+        Called for each invoice by ``_reconcile_invoices``, which shares
+        the write-off arguments between the invoices with the
+        ``reconcile_write_off_cache`` key of the context.
+
+        :returns: True when the invoice has been reconciled
+        """
+        self.ensure_one()
+        prepared = self._prepare_reconcile(
+            write_off_cache=self.env.context.get('reconcile_write_off_cache'))
+        if not prepared:
+            return False
+        lines, kwargs, ctx_vals = prepared
+        lines.with_context(**ctx_vals).reconcile(**kwargs)
+        # a payment shared with the next invoices is no longer available
+        lines.invalidate_cache(['reconcile_id', 'reconcile_partial_id'],
+                               lines.ids)
+        return True
+
+    @api.multi
+    def _prefetch_reconcile(self):
+        """ Load at once the payments and the move lines of the invoices,
+        so the matching of the amounts is done in memory """
+        self.mapped('company_id.currency_id')
+        self.mapped('currency_id')
+        payments = self.mapped('sale_ids.payment_ids')
+        lines = payments | self.mapped('move_id.line_id')
+        # read the lines of all the invoices in one query
+        lines.mapped('account_id.type')
+        lines.mapped('currency_id')
+        lines.mapped('reconcile_id')
+
+    @api.multi
+    @api.returns('self')
+    def _reconcile_invoices(self):
+        """ Reconcile the invoices with the payments of their sales orders
+
+        The payments and the move lines of all the invoices are loaded at
+        once, and the write-off arguments are shared between the invoices.
+
+        :returns: the invoices which cannot be reconciled with their
+                  current payments
+        """
+        invoices = self.with_context(reconcile_write_off_cache={})
+        invoices._prefetch_reconcile()
+        unmatched_ids = [invoice.id for invoice in invoices
+                         if not invoice._reconcile_invoice()]
+        return self.browse(unmatched_ids)
 
     @api.multi
     def reconcile_invoice(self):
         """ Simple method to reconcile the invoice with the payment
         generated on the sale order """
-        for invoice in self:
-            invoice._reconcile_invoice()
+        self._reconcile_invoices()
         return True
@@ -20,23 +20,25 @@
 ##############################################################################
 
 from openerp import models, api
-from openerp.addons.sale_automatic_workflow.automatic_workflow_job import (
-    commit
-)
 
 
 class AutomaticWorkflowJob(models.Model):
     _inherit = 'automatic.workflow.job'
 
     @api.model
-    def _reconcile_invoices(self):
+    def _reconcile_invoices(self, stats=None):
         invoice_model = self.env['account.invoice']
-        for invoice in invoice_model.search([('state', 'in', ['open'])]):
-            with commit(self.env.cr):
-                invoice.reconcile_invoice()
+        invoices = invoice_model._get_reconcile_candidates()
+        self._process_records(invoices, self._reconcile_invoice_batch,
+                              stats=stats, bulk=True)
 
     @api.model
-    def run(self):
-        res = super(AutomaticWorkflowJob, self).run()
-        self._reconcile_invoices()
-        return res
+    def _reconcile_invoice_batch(self, invoices):
+        unmatched = invoices._reconcile_invoices()
+        unmatched._mark_reconcile_checked()
+
+    @api.model
+    def _get_steps(self):
+        steps = super(AutomaticWorkflowJob, self)._get_steps()
+        steps.append(('reconcile', '_reconcile_invoices'))
+        return steps
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2015 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.tests.common import TransactionCase
+
+
+class TestReconcile(TransactionCase):
+
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+        self.partner = self.env['res.partner'].create({'name': 'Customer'})
+        product = self.env.ref('product.product_product_7')
+        self.sale = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'partner_invoice_id': self.partner.id,
+            'partner_shipping_id': self.partner.id,
+            'pricelist_id': self.env.ref('product.list0').id,
+            'order_line': [(0, 0, {'product_id': product.id,
+                                   'product_uom_qty': 1,
+                                   'price_unit': 100.,
+                                   })],
+        })
+        self.invoice = self.env['account.invoice'].create({
+            'partner_id': self.partner.id,
+            'type': 'out_invoice',
+            'account_id': self.partner.property_account_receivable.id,
+            'journal_id': self.env.ref('account.sales_journal').id,
+            'invoice_line': [(0, 0, {
+                'name': product.name,
+                'product_id': product.id,
+                'account_id': self.env.ref('account.a_sale').id,
+                'quantity': 1,
+                'price_unit': 100.,
+            })],
+        })
+        self.invoice.signal_workflow('invoice_open')
+        self.sale.invoice_ids = [(4, self.invoice.id)]
+        self.journal = self.env.ref('account.bank_journal')
+
+    def _candidates(self):
+        return self.env['account.invoice']._get_reconcile_candidates()
+
+    def test_reconcile_once(self):
+        """ A paid invoice is reconciled once and no longer selected """
+        self.sale.add_payment(self.journal.id, 100.)
+        self.assertIn(self.invoice, self._candidates())
+        unmatched = self.invoice._reconcile_invoices()
+        self.assertFalse(unmatched)
+        self.assertEqual(self.invoice.state, 'paid')
+        self.assertNotIn(self.invoice, self._candidates())
+        reconcile_model = self.env['account.move.reconcile']
+        count = reconcile_model.search_count([])
+        self.invoice._reconcile_invoices()
+        self.assertEqual(reconcile_model.search_count([]), count)
+
+    def test_not_selected_after_checked(self):
+        """ An invoice which cannot be reconciled is not selected again
+        until it or its payments are modified
+        """
+        self.sale.add_payment(self.journal.id, 50.)
+        self.assertIn(self.invoice, self._candidates())
+        unmatched = self.invoice._reconcile_invoices()
+        self.assertEqual(unmatched, self.invoice)
+        unmatched._mark_reconcile_checked()
+        self.assertTrue(self.invoice.reconcile_checked_date)
+        self.assertNotIn(self.invoice, self._candidates())
+        # a modification after the last attempt selects it again
+        self.env.cr.execute("UPDATE account_invoice "
+                            "SET reconcile_checked_date = '2000-01-01' "
+                            "WHERE id = %s", (self.invoice.id,))
+        self.invoice.invalidate_cache(['reconcile_checked_date'],
+                                      self.invoice.ids)
+        self.assertIn(self.invoice, self._candidates())
@@ -22,3 +22,4 @@
 
 from . import rental
 from . import wizard
+from . import report
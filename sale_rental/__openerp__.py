@@ -34,6 +34,7 @@
         'sale_view.xml',
         'stock_view.xml',
         'rental_view.xml',
+        'report/rental_return_forecast_view.xml',
         'rental_data.xml',
         'wizard/create_rental_product_view.xml',
         'product_view.xml',
@@ -24,8 +24,10 @@ from openerp import models, fields, api, _
 from openerp.exceptions import Warning, ValidationError
 from openerp.tools import float_compare
 from dateutil.relativedelta import relativedelta
+from collections import defaultdict
 import openerp.addons.decimal_precision as dp
 import logging
+from .rental_timeline import RentalTimeline
 
 logger = logging.getLogger(__name__)
 # TODO : block if we sell a rented product already sold => state
@@ -101,26 +103,77 @@ class SaleOrder(models.Model):
     def _prepare_rental(self, so_line):
         return {'start_order_line_id': so_line.id}
 
+    @api.multi
+    def check_rental_availability(self):
+        overbooked = self.mapped('order_line')._get_overbooked_rentals()
+        if overbooked:
+            raise Warning(
+                _("Not enough units available for these rentals:\n%s")
+                % '\n'.join(
+                    _("%s: %.2f %s requested from %s to %s, "
+                        "%.2f available")
+                    % ((line.name, line.rental_qty,
+                        line.product_id.rented_product_id.uom_id.name) +
+                        line._get_rental_period() + (free_qty, ))
+                    for line, free_qty in overbooked))
+        return True
+
     @api.multi
     def action_button_confirm(self):
         res = super(SaleOrder, self).action_button_confirm()
+        rental_vals = []
+        # end date of the extended rentals by return move, the last
+        # extension wins
+        return_dates = {}
+        sold_in_moves = self.env['stock.move'].browse()
         for order in self:
             for line in order.order_line:
                 if line.rental_type == 'new_rental':
-                    self.env['sale.rental'].create(self._prepare_rental(line))
+                    rental_vals.append(self._prepare_rental(line))
                 elif line.rental_type == 'rental_extension':
-                    line.extension_rental_id.in_move_id.date_expected =\
-                        line.end_date
-                    line.extension_rental_id.in_move_id.date = line.end_date
+                    in_move = line.extension_rental_id.in_move_id
+                    if in_move:
+                        return_dates[in_move.id] = line.end_date
                 elif line.sell_rental_id:
                     if line.sell_rental_id.out_move_id.state != 'done':
                         raise Warning(
                             _('Cannot sell the rental %s because it has '
                                 'not been delivered')
                             % line.sell_rental_id.display_name)
-                    line.sell_rental_id.in_move_id.action_cancel()
+                    sold_in_moves |= line.sell_rental_id.in_move_id
+        self._create_rentals(rental_vals)
+        self._postpone_rental_returns(return_dates)
+        if sold_in_moves:
+            sold_in_moves.action_cancel()
         return res
 
+    @api.model
+    def _create_rentals(self, rental_vals):
+        """ Create the rentals, computing their stored fields once for all
+        the rentals instead of after each creation """
+        rental_obj = self.env['sale.rental'].with_context(recompute=False)
+        rental_ids = [rental_obj.create(vals).id for vals in rental_vals]
+        rentals = self.env['sale.rental'].browse(rental_ids)
+        rentals.recompute()
+        return rentals
+
+    @api.model
+    def _postpone_rental_returns(self, return_dates):
+        """ Move the return of extended rentals to the end date of the
+        extensions, with one write per end date
+
+        :param return_dates: dict {return stock move id: end date}
+        """
+        move_ids_by_date = defaultdict(list)
+        for move_id, end_date in return_dates.iteritems():
+            move_ids_by_date[end_date].append(move_id)
+        move_obj = self.env['stock.move']
+        for end_date, move_ids in move_ids_by_date.iteritems():
+            move_obj.browse(move_ids).write({
+                'date_expected': end_date,
+                'date': end_date,
+                })
+
 
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
@@ -227,36 +280,8 @@ class SaleOrderLine(models.Model):
                     })
                 if not rental_type:
                     res['value']['rental_type'] = 'new_rental'
-                elif (
-                        rental_type == 'new_rental' and
-                        rental_qty and warehouse_id):
-                    product_uom = product_o.rented_product_id.uom_id
-                    warehouse = self.env['stock.warehouse'].browse(
-                        warehouse_id)
-                    rental_in_location = warehouse.rental_in_location_id
-                    product_o_in = self.with_context(
-                        location=rental_in_location.id).env['product.product']\
-                        .browse(product)
-                    in_location_available_qty =\
-                        product_o_in.rented_product_id.qty_available\
-                        - product_o_in.rented_product_id.outgoing_qty
-                    compare_qty = float_compare(
-                        in_location_available_qty,
-                        rental_qty, precision_rounding=product_uom.rounding)
-                    if compare_qty == -1:
-                        res['warning'] = {
-                            'title': _("Not enough stock !"),
-                            'message':
-                            _("You want to rent %.2f %s but you only "
-                                "have %.2f %s currently available on the "
-                                "stock location '%s' ! Make sure that you "
-                                "get some units back in the mean time or "
-                                "re-supply the stock location '%s'.")
-                            % (rental_qty, product_uom.name,
-                                in_location_available_qty,
-                                product_uom.name, rental_in_location.name,
-                                rental_in_location.name)
-                            }
+                # the availability of the rented product depends on the
+                # dates, it is checked by rental_availability_change()
             elif product_o.rental_service_ids:
                 res['value'].update({
                     'can_sell_rental': True,
@@ -320,6 +345,89 @@ class SaleOrderLine(models.Model):
         if self.rental_type == 'new_rental':
             self.extension_rental_id = False
 
+    @api.onchange(
+        'rental_type', 'rental_qty', 'start_date', 'end_date', 'product_id')
+    def rental_availability_change(self):
+        if (
+                self.rental_type != 'new_rental' or
+                not self.rental_qty or
+                not self.product_id.rented_product_id or
+                not self.order_id.warehouse_id):
+            return
+        overbooked = self._get_overbooked_rentals()
+        if overbooked:
+            free_qty = overbooked[0][1]
+            product_uom = self.product_id.rented_product_id.uom_id
+            start_date, end_date = self._get_rental_period()
+            return {'warning': {
+                'title': _("Not enough stock !"),
+                'message':
+                _("You want to rent %.2f %s from %s to %s but you only "
+                    "have %.2f %s available during this period in the "
+                    "warehouse '%s' ! Make sure that you get some units "
+                    "back in the mean time or re-supply the stock "
+                    "location '%s'.")
+                % (self.rental_qty, product_uom.name, start_date, end_date,
+                    free_qty, product_uom.name,
+                    self.order_id.warehouse_id.name,
+                    self.order_id.warehouse_id.rental_in_location_id.name),
+                }}
+
+    @api.multi
+    def _get_rental_period(self):
+        self.ensure_one()
+        today = fields.Date.context_today(self)
+        start_date = self.start_date or today
+        end_date = self.end_date or start_date
+        return start_date, end_date
+
+    @api.multi
+    def _get_overbooked_rentals(self):
+        """ Check the availability of the rented products of new rental
+        lines, taking into account the other rentals and the other lines
+
+        The occupancy timelines are built once per warehouse for all the
+        lines, so a whole quotation is checked at once.
+
+        :returns: list of tuples (sale order line, quantity which can be
+                  rented during the period of the line) for the lines
+                  whose rental quantity exceeds the available quantity
+        """
+        lines_by_warehouse = defaultdict(list)
+        for line in self:
+            if (
+                    line.rental_type == 'new_rental' and
+                    line.rental_qty and
+                    line.product_id.rented_product_id and
+                    line.order_id.warehouse_id):
+                lines_by_warehouse[line.order_id.warehouse_id].append(line)
+        rental_obj = self.env['sale.rental']
+        res = []
+        for warehouse, lines in lines_by_warehouse.iteritems():
+            extra_intervals = defaultdict(list)
+            products = self.env['product.product'].browse()
+            for line in lines:
+                product = line.product_id.rented_product_id
+                start_date, end_date = line._get_rental_period()
+                extra_intervals[product.id].append(
+                    (start_date, end_date, line.rental_qty))
+                products |= product
+            timelines = rental_obj._get_rental_timelines(
+                warehouse, products, extra_intervals=extra_intervals)
+            for line in lines:
+                product = line.product_id.rented_product_id
+                start_date, end_date = line._get_rental_period()
+                # the line covers the whole period, so the other rentals
+                # leave the free quantity plus the quantity of the line
+                free_qty = timelines[product.id].free_qty(
+                    start_date, end_date) + line.rental_qty
+                compare_qty = float_compare(
+                    free_qty, line.rental_qty,
+                    precision_rounding=product.uom_id.rounding)
+                if compare_qty == -1:
+                    res.append((line, free_qty))
+        return res
+
 
 class SaleRental(models.Model):
     _name = 'sale.rental'
@@ -329,8 +437,9 @@ class SaleRental(models.Model):
 
     @api.one
     @api.depends(
-        'start_order_line_id', 'extension_order_line_ids.end_date',
-        'extension_order_line_ids.state', 'start_order_line_id.end_date')
+        'start_order_line_id.order_id.partner_id.name',
+        'start_order_line_id.product_id.rented_product_id.name',
+        'start_order_line_id.start_date', 'end_date', 'state')
     def _display_name(self):
         self.display_name = u'[%s] %s - %s > %s (%s)' % (
             self.partner_id.name,
@@ -340,7 +449,10 @@ class SaleRental(models.Model):
             self.state)  # TODO : display label, not the technical key
 
     @api.one
-    @api.depends('start_order_line_id', 'start_order_line_id.procurement_ids')
+    @api.depends(
+        'start_order_line_id.procurement_ids.move_ids.state',
+        'start_order_line_id.procurement_ids.move_ids.move_dest_id',
+        'sell_order_line_ids.procurement_ids.move_ids.state')
     def _compute_procurement_and_move(self):
         procurement = False
         in_move = False
@@ -386,23 +498,40 @@ class SaleRental(models.Model):
         self.sell_procurement_id = sell_procurement
         self.sell_move_id = sell_move
 
-    @api.one
+    @api.multi
     @api.depends(
         'extension_order_line_ids.end_date', 'extension_order_line_ids.state',
         'start_order_line_id.end_date')
     def _compute_end_date(self):
-        end_date = False
-        if self.extension_order_line_ids:
-            for extension in self.extension_order_line_ids:
-                if extension.state not in ('cancel', 'draft'):
-                    if extension.end_date > end_date:
-                        end_date = extension.end_date
-        if not end_date and self.start_order_line_id:
-            end_date = self.start_order_line_id.end_date
-        self.end_date = end_date
+        # the last end date of the extensions of all the rentals at once,
+        # instead of reading the extension lines of each rental
+        rental_ids = [rental.id for rental in self
+                      if isinstance(rental.id, (int, long))]
+        extension_end_dates = {}
+        if rental_ids:
+            self.env.cr.execute("""
+                SELECT extension_rental_id, max(end_date)
+                FROM sale_order_line
+                WHERE extension_rental_id IN %s
+                AND state NOT IN ('cancel', 'draft')
+                GROUP BY extension_rental_id
+                """, (tuple(rental_ids),))
+            extension_end_dates = dict(self.env.cr.fetchall())
+        for rental in self:
+            if isinstance(rental.id, (int, long)):
+                end_date = extension_end_dates.get(rental.id, False)
+            else:
+                end_date = False
+                for extension in rental.extension_order_line_ids:
+                    if extension.state not in ('cancel', 'draft'):
+                        if extension.end_date > end_date:
+                            end_date = extension.end_date
+            if not end_date and rental.start_order_line_id:
+                end_date = rental.start_order_line_id.end_date
+            rental.end_date = end_date
 
     display_name = fields.Char(
-        compute='_display_name', string='Display Name')
+        compute='_display_name', string='Display Name', store=True)
     start_order_line_id = fields.Many2one(
         'sale.order.line', string='Rental Sale Order Line')
     start_date = fields.Date(
@@ -429,13 +558,13 @@ class SaleRental(models.Model):
         string='Partner', readonly=True)
     procurement_id = fields.Many2one(
         'procurement.order', string="Procurement", readonly=True,
-        compute='_compute_procurement_and_move')
+        compute='_compute_procurement_and_move', store=True)
     out_move_id = fields.Many2one(
         'stock.move', compute='_compute_procurement_and_move',
-        string='Outgoing Stock Move', readonly=True)
+        string='Outgoing Stock Move', readonly=True, store=True, index=True)
     in_move_id = fields.Many2one(
         'stock.move', compute='_compute_procurement_and_move',
-        string='Return Stock Move', readonly=True)
+        string='Return Stock Move', readonly=True, store=True, index=True)
     out_state = fields.Selection([
         ('draft', 'New'),
         ('cancel', 'Cancelled'),
@@ -468,10 +597,10 @@ class SaleRental(models.Model):
         string='Sell Rented Product', readonly=True)
     sell_procurement_id = fields.Many2one(
         'procurement.order', string="Sell Procurement", readonly=True,
-        compute='_compute_procurement_and_move')
+        compute='_compute_procurement_and_move', store=True)
     sell_move_id = fields.Many2one(
         'stock.move', compute='_compute_procurement_and_move',
-        string='Sell Stock Move', readonly=True)
+        string='Sell Stock Move', readonly=True, store=True)
     sell_state = fields.Selection([
         ('draft', 'New'),
         ('cancel', 'Cancelled'),
@@ -486,7 +615,7 @@ class SaleRental(models.Model):
         string='Sell Delivery Order', readonly=True)
     end_date = fields.Date(
         compute='_compute_end_date', string='End Date (extensions included)',
-        readonly=True,
+        readonly=True, store=True, index=True,
         help="End Date of the Rental, taking into account all the "
         "extensions sold to the customer.")
     state = fields.Selection([
@@ -496,7 +625,68 @@ class SaleRental(models.Model):
         ('sold', 'Sold'),
         ('in', 'Back In'),
         ], string='State', compute='_compute_procurement_and_move',
-        readonly=True)
+        readonly=True, store=True, index=True)
+
+    @api.model
+    def _get_rental_fleet_qty(self, warehouse, products):
+        """ Units of the rented products owned by a warehouse for rental:
+        in stock in the Rental In location or rented in the Rental Out
+        location
+
+        :returns: dict {product id: quantity}
+        """
+        fleet_qty = dict.fromkeys(products.ids, 0.)
+        for location in (
+                warehouse.rental_in_location_id,
+                warehouse.rental_out_location_id):
+            if not location:
+                continue
+            for product in products.with_context(location=location.id):
+                fleet_qty[product.id] += product.qty_available
+        return fleet_qty
+
+    @api.model
+    def _get_rental_timelines(self, warehouse, products,
+                              extra_intervals=None):
+        """ Build the occupancy timelines of rented products in a warehouse
+
+        :param products: recordset of rented products
+        :param extra_intervals: optional dict {product id: list of tuples
+                                (start date, end date, quantity)} of
+                                rentals not confirmed yet
+        :returns: dict {product id: RentalTimeline}
+        """
+        intervals = defaultdict(list)
+        for product_id, product_intervals in (
+                extra_intervals or {}).iteritems():
+            intervals[product_id].extend(product_intervals)
+        rentals = self.search([
+            ('state', 'in', ('ordered', 'out', 'sell_progress')),
+            ('start_order_line_id.product_id.rented_product_id', 'in',
+             products.ids),
+            ('start_order_line_id.order_id.warehouse_id', '=', warehouse.id),
+            ])
+        today = fields.Date.context_today(self)
+        for rental in rentals:
+            if rental.out_state == 'cancel':
+                continue
+            if rental.state == 'sell_progress':
+                # the units will be sold, they never come back
+                end_date = None
+            elif rental.state == 'out':
+                # a late rental keeps its units until they are returned
+                end_date = max(rental.end_date, today)
+            else:
+                end_date = rental.end_date
+            if not rental.start_date or end_date is False:
+                continue
+            intervals[rental.rented_product_id.id].append(
+                (rental.start_date, end_date, rental.rental_qty))
+        fleet_qty = self._get_rental_fleet_qty(warehouse, products)
+        return dict(
+            (product.id,
+             RentalTimeline(fleet_qty[product.id], intervals[product.id]))
+            for product in products)
 
 
 class StockWarehouse(models.Model):
@@ -0,0 +1,97 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Sale Rental module for Odoo
+#    Copyright (C) 2014-2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from openerp import fields
+
+
+class RentalTimeline(object):
+    """ Number of units of a product rented over time
+
+    The timeline is built from the rental periods as a step function: the
+    occupancy is constant between two consecutive dates where a rental
+    starts or ends. The maximum occupancy over any period is then answered
+    with a binary search of the dates of the period and a lookup in a
+    sparse table of the maximums, so in O(log n) for n rentals.
+    """
+
+    def __init__(self, fleet_qty, intervals):
+        """
+        :param fleet_qty: number of units of the product available for
+                          rental
+        :param intervals: list of tuples (start date, end date, quantity),
+                          the dates being strings, the end date included,
+                          an end date None meaning the units never come back
+        """
+        self.fleet_qty = fleet_qty
+        changes = defaultdict(float)
+        for start_date, end_date, qty in intervals:
+            changes[start_date] += qty
+            if end_date is not None:
+                changes[self._next_day(end_date)] -= qty
+        # the occupancy is levels[i] from dates[i] to dates[i + 1] excluded
+        self.dates = sorted(changes)
+        self.levels = []
+        level = 0.
+        for date in self.dates:
+            level += changes[date]
+            self.levels.append(level)
+        self._build_sparse_table()
+
+    @staticmethod
+    def _next_day(date):
+        return fields.Date.to_string(
+            fields.Date.from_string(date) + timedelta(days=1))
+
+    def _build_sparse_table(self):
+        # table[k][i] is the maximum of levels[i:i + 2 ** k]
+        self.table = [self.levels]
+        width = 1
+        while width * 2 <= len(self.levels):
+            previous = self.table[-1]
+            self.table.append([max(previous[i], previous[i + width])
+                               for i in range(len(previous) - width)])
+            width *= 2
+
+    def _range_max(self, first, last):
+        """ Maximum of levels[first:last + 1] """
+        k = (last - first + 1).bit_length() - 1
+        row = self.table[k]
+        return max(row[first], row[last - (1 << k) + 1])
+
+    def max_occupancy(self, start_date, end_date):
+        """ Maximum number of units rented on a day between ``start_date``
+        and ``end_date`` (included) """
+        last = bisect_right(self.dates, end_date) - 1
+        if last < 0:
+            return 0.
+        first = max(bisect_right(self.dates, start_date) - 1, 0)
+        # before the first date, nothing is rented
+        return max(self._range_max(first, last), 0.)
+
+    def free_qty(self, start_date, end_date):
+        """ Number of units which can be rented during the whole period
+        between ``start_date`` and ``end_date`` (included) """
+        return self.fleet_qty - self.max_occupancy(start_date, end_date)
@@ -0,0 +1,76 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Sale Rental module for Odoo
+#    Copyright (C) 2014-2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import models, fields
+from openerp import tools
+import openerp.addons.decimal_precision as dp
+
+
+class SaleRentalReturnForecast(models.Model):
+    _name = 'sale.rental.return.forecast'
+    _description = "Rental Return Forecast"
+    _auto = False
+    _rec_name = 'date'
+    _order = 'date'
+
+    date = fields.Date(
+        string='Expected Return Date', readonly=True,
+        help="Day of the expected date of the return move, in UTC.")
+    warehouse_id = fields.Many2one(
+        'stock.warehouse', string='Warehouse', readonly=True)
+    product_id = fields.Many2one(
+        'product.product', string='Rented Product', readonly=True)
+    company_id = fields.Many2one(
+        'res.company', string='Company', readonly=True)
+    product_qty = fields.Float(
+        string='Quantity', readonly=True,
+        digits=dp.get_precision('Product Unit of Measure'))
+    rental_count = fields.Integer(string='# of Rentals', readonly=True)
+
+    def init(self, cr):
+        # one line per day, warehouse and product with the quantities of
+        # the return moves of the rentals not received yet. The days are
+        # the UTC days of the expected dates: the return moves are planned
+        # at midnight UTC of the end date of the rentals, which is then
+        # the day of the line whatever the timezone of the user.
+        tools.drop_view_if_exists(cr, self._table)
+        cr.execute("""
+            CREATE OR REPLACE VIEW sale_rental_return_forecast AS (
+                SELECT
+                    min(m.id) AS id,
+                    m.date_expected::date AS date,
+                    so.warehouse_id AS warehouse_id,
+                    m.product_id AS product_id,
+                    m.company_id AS company_id,
+                    sum(m.product_qty) AS product_qty,
+                    count(r.id) AS rental_count
+                FROM sale_rental r
+                JOIN stock_move m ON m.id = r.in_move_id
+                JOIN sale_order_line sol ON sol.id = r.start_order_line_id
+                JOIN sale_order so ON so.id = sol.order_id
+                WHERE m.state NOT IN ('done', 'cancel')
+                GROUP BY
+                    m.date_expected::date,
+                    so.warehouse_id,
+                    m.product_id,
+                    m.company_id
+            )""")
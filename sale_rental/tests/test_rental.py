@@ -0,0 +1,245 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Sale Rental module for Odoo
+#    Copyright (C) 2014-2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from datetime import timedelta
+
+from openerp import exceptions, fields
+from openerp.tests.common import TransactionCase
+
+
+class TestRental(TransactionCase):
+
+    def setUp(self):
+        super(TestRental, self).setUp()
+        self.warehouse = self.env.ref('stock.warehouse0')
+        self.partner = self.env.ref('base.res_partner_2')
+        self.day_uom = self.env.ref('product.product_uom_day')
+        self.rented_product = self.env['product.product'].create({
+            'name': 'Projector',
+            'type': 'product',
+        })
+        self.service = self.env['product.product'].create({
+            'name': 'Rental of one Projector',
+            'type': 'service',
+            'uom_id': self.day_uom.id,
+            'uom_po_id': self.day_uom.id,
+            'must_have_dates': True,
+            'rented_product_id': self.rented_product.id,
+        })
+        self.env['stock.quant'].create({
+            'product_id': self.rented_product.id,
+            'location_id': self.warehouse.rental_in_location_id.id,
+            'qty': 2.,
+        })
+
+    def _prepare_line(self, qty, start_date, end_date, **kwargs):
+        days = (fields.Date.from_string(end_date) -
+                fields.Date.from_string(start_date)).days + 1
+        vals = {
+            'name': self.service.name,
+            'product_id': self.service.id,
+            'product_uom': self.day_uom.id,
+            'product_uom_qty': qty * days,
+            'price_unit': 10.,
+            'rental': True,
+            'rental_type': 'new_rental',
+            'rental_qty': qty,
+            'must_have_dates': True,
+            'start_date': start_date,
+            'end_date': end_date,
+            'number_of_days': days,
+        }
+        vals.update(kwargs)
+        return vals
+
+    def _create_order(self, lines):
+        """ Create a quotation with one line per tuple (rental quantity,
+        start date, end date) """
+        return self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'partner_invoice_id': self.partner.id,
+            'partner_shipping_id': self.partner.id,
+            'pricelist_id': self.env.ref('product.list0').id,
+            'warehouse_id': self.warehouse.id,
+            'order_line': [(0, 0, self._prepare_line(*line))
+                           for line in lines],
+        })
+
+    def _create_extension_order(self, extensions):
+        """ Create a quotation extending each rental of the tuples
+        (rental, end date) """
+        lines = []
+        for rental, end_date in extensions:
+            start_date = fields.Date.to_string(
+                fields.Date.from_string(rental.end_date) +
+                timedelta(days=1))
+            lines.append((0, 0, self._prepare_line(
+                rental.rental_qty, start_date, end_date,
+                rental_type='rental_extension',
+                extension_rental_id=rental.id)))
+        return self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'partner_invoice_id': self.partner.id,
+            'partner_shipping_id': self.partner.id,
+            'pricelist_id': self.env.ref('product.list0').id,
+            'warehouse_id': self.warehouse.id,
+            'order_line': lines,
+        })
+
+    def _get_rentals(self, order):
+        return self.env['sale.rental'].search(
+            [('start_order_line_id', 'in', order.order_line.ids)],
+            order='id')
+
+    def _done_move(self, move):
+        move.action_assign()
+        move.action_done()
+        self.assertEqual(move.state, 'done')
+
+    def assertStoredRental(self, rental):
+        """ The values stored in the database match the values computed
+        from the current sale order lines and stock moves """
+        field_names = ['procurement_id', 'out_move_id', 'in_move_id',
+                       'state', 'end_date', 'display_name']
+        self.env.invalidate_all()
+        self.env.cr.execute(
+            "SELECT %s FROM sale_rental WHERE id = %%s"
+            % ', '.join(field_names), (rental.id,))
+        stored = self.env.cr.fetchone()
+        with self.env.do_in_draft():
+            rental._compute_procurement_and_move()
+            rental._compute_end_date()
+            rental._display_name()
+            computed = (rental.procurement_id.id or None,
+                        rental.out_move_id.id or None,
+                        rental.in_move_id.id or None,
+                        rental.state or None,
+                        rental.end_date or None,
+                        rental.display_name)
+        self.env.invalidate_all()
+        self.assertEqual(stored, computed)
+
+    def test_onchange_availability_warning(self):
+        self._create_order([(2, '2030-05-01', '2030-05-10')
+                            ]).action_button_confirm()
+        line = self._create_order([(1, '2030-05-10', '2030-05-15')
+                                   ]).order_line
+        res = line.rental_availability_change()
+        self.assertIn('warning', res)
+        # the units are back the day after the end of the rental
+        line.write(self._prepare_line(1, '2030-05-11', '2030-05-15'))
+        self.assertFalse(line.rental_availability_change())
+
+    def test_check_rental_availability(self):
+        """ The lines of the quotation are checked with the confirmed
+        rentals and between themselves """
+        self._create_order([(1, '2030-05-01', '2030-05-10')
+                            ]).action_button_confirm()
+        order = self._create_order([(1, '2030-05-05', '2030-05-15')])
+        self.assertTrue(order.check_rental_availability())
+        order.write({'order_line': [
+            (0, 0, self._prepare_line(1, '2030-05-08', '2030-05-12'))]})
+        with self.assertRaises(exceptions.Warning):
+            order.check_rental_availability()
+
+    def test_fleet_qty(self):
+        """ The rented units are still part of the fleet until they are
+        back """
+        order = self._create_order([(2, '2030-05-01', '2030-05-10')])
+        order.action_button_confirm()
+        rental = self._get_rentals(order)
+        rental_obj = self.env['sale.rental']
+        product_id = self.rented_product.id
+        timeline = rental_obj._get_rental_timelines(
+            self.warehouse, self.rented_product)[product_id]
+        self.assertEqual(timeline.free_qty('2030-05-01', '2030-05-10'), 0)
+        self.assertEqual(timeline.free_qty('2030-05-11', '2030-05-20'), 2)
+        self._done_move(rental.out_move_id)
+        timeline = rental_obj._get_rental_timelines(
+            self.warehouse, self.rented_product)[product_id]
+        self.assertEqual(timeline.fleet_qty, 2)
+        self.assertEqual(timeline.free_qty('2030-05-01', '2030-05-10'), 0)
+        self._done_move(rental.in_move_id)
+        timeline = rental_obj._get_rental_timelines(
+            self.warehouse, self.rented_product)[product_id]
+        self.assertEqual(timeline.free_qty('2030-05-01', '2030-05-10'), 2)
+
+    def test_stored_state_and_moves(self):
+        order = self._create_order([(1, '2030-05-01', '2030-05-10')])
+        order.action_button_confirm()
+        rental = self._get_rentals(order)
+        self.assertEqual(rental.state, 'ordered')
+        self.assertTrue(rental.out_move_id)
+        self.assertTrue(rental.in_move_id)
+        self.assertEqual(rental.out_move_id.move_dest_id, rental.in_move_id)
+        self.assertStoredRental(rental)
+        self._done_move(rental.out_move_id)
+        self.assertEqual(rental.state, 'out')
+        self.assertStoredRental(rental)
+        self._done_move(rental.in_move_id)
+        self.assertEqual(rental.state, 'in')
+        self.assertStoredRental(rental)
+
+    def test_create_rentals_in_batch(self):
+        order = self._create_order([(1, '2030-05-01', '2030-05-10'),
+                                    (1, '2030-05-03', '2030-05-12')])
+        order.action_button_confirm()
+        rentals = self._get_rentals(order)
+        self.assertEqual(len(rentals), 2)
+        for rental in rentals:
+            self.assertEqual(rental.state, 'ordered')
+            self.assertEqual(rental.end_date,
+                             rental.start_order_line_id.end_date)
+            self.assertStoredRental(rental)
+
+    def test_postpone_rental_returns(self):
+        order = self._create_order([(1, '2030-05-01', '2030-05-10'),
+                                    (1, '2030-05-03', '2030-05-12')])
+        order.action_button_confirm()
+        rentals = self._get_rentals(order)
+        extension = self._create_extension_order(
+            [(rental, '2030-05-20') for rental in rentals])
+        extension.action_button_confirm()
+        for rental in rentals:
+            self.assertEqual(rental.in_move_id.date_expected[:10],
+                             '2030-05-20')
+            self.assertEqual(rental.end_date, '2030-05-20')
+            self.assertIn('2030-05-20', rental.display_name)
+            self.assertStoredRental(rental)
+
+    def test_return_forecast(self):
+        order = self._create_order([(1, '2030-05-01', '2030-05-10'),
+                                    (1, '2030-05-03', '2030-05-10')])
+        order.action_button_confirm()
+        rentals = self._get_rentals(order)
+        forecast_obj = self.env['sale.rental.return.forecast']
+        domain = [('product_id', '=', self.rented_product.id),
+                  ('warehouse_id', '=', self.warehouse.id)]
+        forecasts = forecast_obj.search(domain)
+        self.assertEqual(forecasts.mapped('date'), ['2030-05-10'])
+        self.assertEqual(forecasts.product_qty, 2)
+        self.assertEqual(forecasts.rental_count, 2)
+        self._done_move(rentals[0].out_move_id)
+        self._done_move(rentals[0].in_move_id)
+        forecasts = forecast_obj.search(domain)
+        self.assertEqual(forecasts.product_qty, 1)
+        self.assertEqual(forecasts.rental_count, 1)
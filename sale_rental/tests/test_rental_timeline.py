@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    Sale Rental module for Odoo
+#    Copyright (C) 2014-2015 Akretion (http://www.akretion.com)
+#    @author Alexis de Lattre <alexis.delattre@akretion.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from datetime import date, timedelta
+import random
+
+from openerp import fields
+from openerp.tests.common import TransactionCase
+
+from ..rental_timeline import RentalTimeline
+
+
+class TestRentalTimeline(TransactionCase):
+
+    def test_overlapping_rentals(self):
+        timeline = RentalTimeline(3, [
+            ('2030-01-01', '2030-01-10', 1),
+            ('2030-01-05', '2030-01-15', 2),
+            ('2030-01-11', '2030-01-20', 1),
+            ])
+        self.assertEqual(timeline.max_occupancy('2030-01-01', '2030-01-04'),
+                         1)
+        self.assertEqual(timeline.max_occupancy('2030-01-05', '2030-01-10'),
+                         3)
+        self.assertEqual(timeline.max_occupancy('2030-01-11', '2030-01-15'),
+                         3)
+        self.assertEqual(timeline.max_occupancy('2030-01-16', '2030-01-20'),
+                         1)
+        self.assertEqual(timeline.free_qty('2030-01-05', '2030-01-05'), 0)
+        self.assertEqual(timeline.free_qty('2030-01-16', '2030-01-31'), 2)
+
+    def test_adjacent_rentals(self):
+        """ The end date is included, the units are available again the
+        day after """
+        timeline = RentalTimeline(2, [
+            ('2030-01-01', '2030-01-10', 2),
+            ('2030-01-11', '2030-01-20', 2),
+            ])
+        self.assertEqual(timeline.max_occupancy('2030-01-01', '2030-01-20'),
+                         2)
+        self.assertEqual(timeline.free_qty('2030-01-10', '2030-01-11'), 0)
+        self.assertEqual(timeline.free_qty('2030-01-21', '2030-01-25'), 2)
+
+    def test_period_outside_rentals(self):
+        timeline = RentalTimeline(2, [('2030-01-10', '2030-01-20', 1)])
+        self.assertEqual(timeline.free_qty('2029-12-01', '2030-01-09'), 2)
+        self.assertEqual(timeline.free_qty('2029-12-01', '2030-01-10'), 1)
+        self.assertEqual(timeline.free_qty('2030-01-21', '2030-02-01'), 2)
+        self.assertEqual(RentalTimeline(2, []).free_qty(
+            '2030-01-01', '2030-01-31'), 2)
+
+    def test_rental_never_returned(self):
+        timeline = RentalTimeline(2, [('2030-01-10', None, 1)])
+        self.assertEqual(timeline.free_qty('2030-01-01', '2030-01-09'), 2)
+        self.assertEqual(timeline.free_qty('2031-01-01', '2031-01-02'), 1)
+
+    def test_fleet_qty_exceeded(self):
+        """ The free quantity is negative when the fleet is overbooked """
+        timeline = RentalTimeline(1, [
+            ('2030-01-01', '2030-01-10', 1),
+            ('2030-01-10', '2030-01-20', 1),
+            ])
+        self.assertEqual(timeline.free_qty('2030-01-01', '2030-01-09'), 0)
+        self.assertEqual(timeline.free_qty('2030-01-01', '2030-01-31'), -1)
+
+    def test_matches_daily_occupancy(self):
+        """ Compare with the occupancy computed day by day """
+        rand = random.Random(42)
+        first_day = date(2030, 1, 1)
+
+        def day(offset):
+            return fields.Date.to_string(first_day + timedelta(days=offset))
+
+        intervals = []
+        occupancy = [0.] * 60
+        for __ in range(30):
+            start = rand.randint(0, 49)
+            end = start + rand.randint(0, 9)
+            qty = rand.randint(1, 3)
+            intervals.append((day(start), day(end), qty))
+            for offset in range(start, end + 1):
+                occupancy[offset] += qty
+        timeline = RentalTimeline(10, intervals)
+        for __ in range(200):
+            start = rand.randint(0, 59)
+            end = rand.randint(start, 59)
+            self.assertEqual(timeline.max_occupancy(day(start), day(end)),
+                             max(occupancy[start:end + 1]))